@@ -8,116 +8,323 @@ import shutil
 import subprocess
 import tempfile
 import csv
-from collections import namedtuple, Counter
-from collections import deque
+import shlex
+import bisect
+import hashlib
+import functools
+import atexit
+import contextlib
+import json
+import signal
+import socketserver
+import threading
+import time
+from collections import namedtuple, Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), "..", "lib", "python"))
+
+# numpy is not bundled in lib/python, see requirements.txt
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("aligntool requires numpy >= 1.20, install it with: pip3 install -r requirements.txt")
+if tuple(int(x) for x in np.__version__.split(".")[:2]) < (1, 20):
+    sys.exit("aligntool requires numpy >= 1.20, found %s" % np.__version__)
 import tgt
 import util
+import audio
+import dsp
+import g2p
 import xlsbatch
 import re
-import gui
 
 
 cachedir = "."
+# size limit of the MAUS result cache (<cachedir>/aligntool.maus) in MB, the least recently used results are removed
+# beyond it. The directory can also be removed at any time, results are recomputed.
+maus_cache_limit = float(os.environ.get("ALIGNTOOL_MAUS_CACHE_MB", 256))
 BeepTuple = namedtuple("beep_iv_tuple", ["t_start", "t_end", "correlation"])
-IntensityVal = namedtuple("IntensityVal", ["t", "intensity"])
+dict_lock = threading.Lock()
+# pronunciation dictionaries by file name, see load_dict_cached
+dict_cache = {}
+# resampled reference beeps and their spectra, see load_beep_template
+beep_templates = {}
+# denoised speech channels by recording and settings, see denoised_channel. By default segment_speech and
+# align_maus use different noise intervals and filters (those of their former praat scripts) and only share a
+# channel if given the same options.
+denoised_files = OrderedDict()
+denoise_lock = threading.Lock()
+denoise_tmpdir = None
+# denoised files kept while unused
+denoise_keep = 2
+# serve: socket and one job at a time
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "aligntool.%s.sock" % os.getuid())
+job_lock = threading.Lock()
+LOG_FORMAT = '-=%(levelname)s=- [%(asctime)s.%(msecs)d] %(message)s'
+LOG_DATEFORMAT = '%H:%M:%S'
+# shared pool for local MAUS runs, see get_maus_executor
+maus_executor = None
+maus_executor_lock = threading.Lock()
+# default spectral subtraction settings, those of the former praat scripts of segmentSpeech and alignMAUS
+VAD_DENOISE_PARAMS = dict(windowlength=0.01, minfreq=80.0, maxfreq=16000.0, smoothing=10.0)
+MAUS_DENOISE_PARAMS = dict(windowlength=0.025, minfreq=80.0, maxfreq=8000.0, smoothing=40.0)
+# command line parsers by class and program name, see get_parser
+parsers = {}
+parser_lock = threading.Lock()
+
+
+def load_beep_template(refbeep, samplerate):
+    """
+    Reference beep resampled to the recording's rate, and its spectrum for the correlation. Both are cached in
+    memory and on disk, keyed by the beep file's content hash, the target rate and the fft size.
+    :return: (template, spectrum, fft size, beep duration)
+    """
+    with open(refbeep, 'rb') as f:
+        beephash = hashlib.sha1(f.read()).hexdigest()
+    beep = audio.WavFile(refbeep)
+    nfft = dsp.fft_size(int(np.ceil(beep.duration * samplerate)) + 1)
+    key = (beephash, samplerate, nfft)
+    if key not in beep_templates:
+        cachefilename = os.path.join(cachedir, "aligntool.beeps", "%s.%s.%s.npz" % key)
+        if os.path.exists(cachefilename):
+            with np.load(cachefilename) as cached:
+                template, spectrum = cached["template"], cached["spectrum"]
+        else:
+            logging.info("Resampling reference beep %s to %s Hz" % (refbeep, samplerate))
+            template = dsp.resample(beep.channel(1), beep.samplerate, samplerate)
+            spectrum = dsp.template_spectrum(template, nfft)
+            os.makedirs(os.path.dirname(cachefilename), exist_ok=True)
+            # write and rename, parallel workers may load or store the same template
+            tmpfile = "%s.%s.tmp" % (cachefilename, os.getpid())
+            with open(tmpfile, 'wb') as f:
+                np.savez(f, template=template, spectrum=spectrum)
+            os.replace(tmpfile, cachefilename)
+        beep_templates[key] = (template, spectrum)
+    template, spectrum = beep_templates[key]
+    return template, spectrum, nfft, beep.duration
 
 
 def segment_beeps(infile, outfile, wavfile, beepchannel, refbeep,
                   silencethreshold, minsoundingduration, seekflank, mincorrelation):
     logging.info("Segmenting beeps in %s" % wavfile)
-    tmpdir = tempfile.mkdtemp()
+    duration, samplerate = util.get_wav_duration(wavfile)
+    tg, tier = util.init_textgrid(infile, duration, "seg.beep")
+    wav = audio.open_wav(wavfile)
+    read = functools.partial(wav.read, beepchannel)
+    # beeps are searched only around the sounding intervals of the beep channel
+    intensities = measure_intensity(wavfile, beepchannel, minpitch=400, subtractmean=True)
+    level = intensities[1].max() - abs(silencethreshold)
+    candidates = np.array([iv.start_time for iv in detect_speech_chunks(intensities, level, duration,
+                                                                        0.03, minsoundingduration)])
+    dx = 1.0 / samplerate
+    beeplists = []
+    for rb in refbeep:
+        logging.info("Running correlation search for beep %s" % rb)
+        # the short reference beep is brought to the recording's rate, never the other way round
+        template, spectrum, nfft, beeplength = load_beep_template(rb, samplerate)
+        # The maximum of the correlation is typically at the beginning of the interval, we search around there
+        t_starts, values = dsp.cross_correlation_maxima(read, wav.nframes, template, spectrum, nfft, dx,
+                                                        candidates - beeplength * 0.5, candidates + beeplength * 0.5)
+        if seekflank:
+            # Refine start times inside a 10ms window, threshold based
+            t_starts = dsp.seek_flanks_streaming(read, wav.nframes, 0.5 * dx, dx, t_starts)
+        beeplists.append([BeepTuple(float(t), float(t) + beeplength, float(v)) for t, v in zip(t_starts, values)])
+
+    selected = resolve_beep_overlaps(beeplists, mincorrelation)
+    tier.add_annotations(anno for anno, _ in selected)
+    cnt = Counter(rbindex for _, rbindex in selected)
+    logging.info("Found %d beep instances with (index, count) distribution %s" %
+                 (len(selected), sorted(cnt.items())))
+    tier = tier.get_copy_with_gaps_filled(empty_string="speech")
+    if len(tier) > 0:
+        tier[0].text = ""
+        logging.info("Note: setting first (silence) interval empty")
+    tg.add_tier(tier)
+    util.write_textgrid(tg, outfile)
+
+
+def resolve_beep_overlaps(beeplists, mincorrelation):
+    """
+    Merges the beep candidates of all reference beeps and keeps the non-overlapping set with the highest total
+    correlation (weighted interval scheduling). The reference beeps may have found different numbers of candidates.
+    :return: list of (annotation, reference beep index) sorted by time
+    """
+    candidates = [(bt, rbindex) for rbindex, beeplist in enumerate(beeplists) for bt in beeplist]
+    valid = sorted([c for c in candidates if c[0].correlation >= mincorrelation], key=lambda c: c[0].t_end)
+    ends = [bt.t_end for bt, _ in valid]
+    best = [0.0]
+    for k, (bt, _) in enumerate(valid):
+        # best[p] covers all candidates ending before this one starts
+        p = bisect.bisect_right(ends, bt.t_start, 0, k)
+        best.append(max(best[k], best[p] + bt.correlation))
+    selected = []
+    k = len(valid)
+    while k > 0:
+        bt, rbindex = valid[k - 1]
+        if best[k] == best[k - 1]:
+            k -= 1
+            continue
+        anno = tgt.Annotation(bt.t_start, bt.t_end, "beep")
+        anno.correlation = bt.correlation
+        selected.append((anno, rbindex))
+        k = bisect.bisect_right(ends, bt.t_start, 0, k - 1)
+    selected.reverse()
+
+    # report weak candidates that were not replaced by a better match, once per position
+    starts = [anno.start_time for anno, _ in selected]
+    warned_end = None
+    for bt, _ in sorted([c for c in candidates if c[0].correlation < mincorrelation], key=lambda c: c[0].t_start):
+        i = bisect.bisect_left(starts, bt.t_end)
+        if i > 0 and selected[i - 1][0].end_time > bt.t_start:
+            continue
+        if warned_end is not None and warned_end > bt.t_start:
+            continue
+        logging.warning("low correlation (%.02f) with reference beep at %.4f seconds" % (bt.correlation, bt.t_start))
+        warned_end = bt.t_end
+    return selected
+
+
+def measure_intensity(wavfile, channel, minpitch=100, timestep=0.01, subtractmean=False):
+    """
+    Intensity contour of a channel, streamed from disk block by block.
+    :return: (times, values) arrays
+    """
+    wav = audio.open_wav(wavfile)
+    return dsp.intensity(functools.partial(wav.read, channel), wav.nframes, wav.samplerate,
+                         minpitch, timestep, subtractmean)
+
+
+@contextlib.contextmanager
+def denoised_channel(wavfile, channel, trainbegin, trainwindow, params):
+    """
+    The speech channel with the noise estimated in [trainbegin, trainbegin + trainwindow] removed, as a mono wav
+    file. It is computed once per recording, noise interval and filter settings and shared by all stages running in
+    this process. Files in use are not removed, of the unused ones the denoise_keep most recent are kept.
+    :param params: keyword arguments of dsp.spectral_subtraction
+    """
+    global denoise_tmpdir
+    path = os.path.realpath(wavfile)
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size, channel, trainbegin, trainwindow, tuple(sorted(params.items())))
+    with denoise_lock:
+        # [future of the file, number of users]
+        entry = denoised_files.get(key)
+        owner = entry is None
+        if owner:
+            if denoise_tmpdir is None:
+                denoise_tmpdir = tempfile.mkdtemp(prefix="aligntool.denoise.")
+                atexit.register(shutil.rmtree, denoise_tmpdir, True)
+            entry = denoised_files[key] = [Future(), 0]
+        denoised_files.move_to_end(key)
+        entry[1] += 1
     try:
-        duration, _ = util.get_wav_duration(wavfile)
-        tg, tier = util.init_textgrid(infile, duration, "seg.beep")
-        beepsegmentscript = os.path.join(os.path.dirname(sys.argv[0]), "beepsegment.praat")
-        beeplists = []
-        for rb in refbeep:
-            logging.info("Running correlation search for beep %s" % rb)
-            result = util.call_check(["praat", "--run", beepsegmentscript, os.path.realpath(wavfile), str(beepchannel),
-                                      os.path.realpath(rb), str(silencethreshold), str(minsoundingduration),
-                                      str(int(seekflank))], True)
-            beeplist = []
-            for line in result.decode().split("\n"):
-                if line:
-                    t_start, t_end, correlation = line.split("\t")
-                    bt = BeepTuple(float(t_start), float(t_end), float(correlation))
-                    beeplist.append(bt)
-            beeplists.append(beeplist)
-
-        max_index_list = []
-        for btlist in zip(*beeplists):
-            bt = max(btlist, key=lambda t: t.correlation)
-            max_index_list.append(btlist.index(bt))
-            if bt.correlation < mincorrelation:
-                logging.warning("low correlation (%.02f) with reference beep at %.4f seconds" %
-                                (bt.correlation, bt.t_start))
-                continue
-            overlapping_beeps = tier.get_annotations_between_timepoints(bt.t_start, bt.t_end,
-                                                                        left_overlap=True, right_overlap=True)
-            can_add = True
-            for x in overlapping_beeps:
-                if x.correlation < bt.correlation:
-                    tier.delete_annotation_by_start_time(x.start_time)
-                else:
-                    can_add = False
-            if can_add:
-                anno = tgt.Annotation(bt.t_start, bt.t_end, "beep")
-                anno.correlation = bt.correlation
-                tier.add_annotation(anno)
-        cnt = Counter(max_index_list)
-        logging.info("Found %d beep instances with (index, count) distribution %s" %
-                     (len(max_index_list), sorted(cnt.items())))
-        tier = tier.get_copy_with_gaps_filled(empty_string="speech")
-        if len(tier) > 0:
-            tier[0].text = ""
-            logging.info("Note: setting first (silence) interval empty")
-        tg.add_tier(tier)
-        logging.info("Writing %s" % outfile)
-        tgt.io.write_to_file(textgrid=tg, filename=outfile, format="long")
+        if owner:
+            # computed outside of the lock, other recordings are denoised concurrently
+            outfile = os.path.join(denoise_tmpdir, "%s.wav" % hashlib.sha1(repr(key).encode()).hexdigest())
+            try:
+                logging.info("Denoising channel %s of %s, noise estimated from %s to %s seconds" % (
+                    channel, wavfile, trainbegin, trainbegin + trainwindow))
+                wav = audio.open_wav(wavfile)
+                blocks = dsp.spectral_subtraction(functools.partial(wav.read, channel), wav.nframes, wav.samplerate,
+                                                  trainbegin, trainbegin + trainwindow, **params)
+                audio.write_wav_blocks(outfile, (audio.float_to_pcm16(block) for block in blocks), wav.samplerate)
+                entry[0].set_result(outfile)
+            except BaseException as e:
+                entry[0].set_exception(e)
+                raise
+        yield entry[0].result()
     finally:
-        shutil.rmtree(tmpdir)
+        with denoise_lock:
+            entry[1] -= 1
+            release_denoised()
 
 
-def segment_speech_praat(wavfile, channel=1, denoise=False, trainbegin=0, trainwindow=1, threshold=50,
-                         min_sil_duration=0.02, min_snd_duration=0.02):
-    vadscript = os.path.join(os.path.dirname(sys.argv[0]), "vad.praat")
-    result = util.call_check(["praat", "--run", vadscript, os.path.realpath(wavfile), str(channel),
-                              str(int(denoise)), str(trainbegin), str(trainwindow), str(threshold),
-                              str(min_sil_duration), str(min_snd_duration)], True)
-    speech_chunks = []
-    intensities = []
-    for line in result.decode().split("\n"):
-        items = line.split("\t")
-        if line.startswith("silence threshold"):
-            logging.info(line)
-        elif len(items) > 2:
-            if items[0] == "chunk":
-                iv = tgt.Interval(float(items[1]), float(items[2]), items[3])
-                iv.as_db = float(items[3])
-                speech_chunks.append(iv)
-            elif items[0] == "itn":
-                intensities.append(IntensityVal(float(items[1]), float(items[2])))
-    return speech_chunks, intensities
-
-
-def window(seq, n):
-    it = iter(seq)
-    win = deque((next(it, None) for _ in range(n)), maxlen=n)
-    yield win
-    append = win.append
-    for e in it:
-        append(e)
-        yield win
+def release_denoised():
+    """
+    Removes failed and the least recently used unused denoised files beyond denoise_keep, with denoise_lock held.
+    """
+    unused = [k for k, e in denoised_files.items() if e[1] == 0 and e[0].done()]
+    for k in unused:
+        if denoised_files[k][0].exception() is not None:
+            del denoised_files[k]
+    unused = [k for k in unused if k in denoised_files]
+    while len(unused) > denoise_keep:
+        future, _ = denoised_files.pop(unused.pop(0))
+        os.remove(future.result())
 
 
 def find_silence_level(intensities, window_size):
-    min_max_val = None
-    for w in window(intensities, int(window_size*100)):
-        max_int = max(w, key=lambda x: x.intensity)
-        if min_max_val is None or min_max_val.intensity > max_int.intensity:
-            min_max_val = max_int
-    return min_max_val.intensity
+    """
+    :return: the lowest maximum of the intensity contour in a sliding window of window_size seconds
+    """
+    _, values = intensities
+    n = min(max(int(window_size*100), 1), len(values))
+    return float(np.lib.stride_tricks.sliding_window_view(values, n).max(axis=1).min())
+
+
+def cut_short_intervals(ivs, speech, min_duration):
+    # same as praat's IntervalTier_cutIntervals_minimumDuration: short intervals are absorbed by their predecessor
+    i = 0
+    while i < len(ivs) and len(ivs) > 1:
+        start, end, is_speech = ivs[i]
+        if is_speech == speech and end - start < min_duration:
+            if i == 0:
+                ivs[1][0] = start
+            else:
+                ivs[i - 1][1] = end
+            del ivs[i]
+        else:
+            i += 1
+    return ivs
+
+
+def combine_intervals(ivs, speech):
+    combined = ivs[:1]
+    for iv in ivs[1:]:
+        if iv[2] == speech and combined[-1][2] == speech:
+            combined[-1][1] = iv[1]
+        else:
+            combined.append(iv)
+    return combined
+
+
+def detect_speech_chunks(intensities, threshold, duration, min_sil_duration=0.02, min_snd_duration=0.02):
+    """
+    Equivalent of praat's Intensity: To TextGrid (silences) plus the mean intensity per chunk,
+    computed from an already extracted intensity contour.
+    :param threshold: absolute silence level in db
+    :return: speech intervals with their mean intensity as text and in as_db
+    """
+    times, values = intensities
+    maxintensity = float(values.max())
+    sndb = max(maxintensity - threshold, 0.01)
+    logging.info("silence threshold: %s db" % -sndb)
+    level = maxintensity - sndb
+    if min_sil_duration > duration or level < values.min():
+        ivs = [[0.0, duration, True]]
+    else:
+        speech = values >= level
+        # a new interval starts at each frame whose state differs from the previous frame
+        changes = np.flatnonzero(speech[1:] != speech[:-1]) + 1
+        starts = [0.0] + times[changes].tolist()
+        ivs = [[start, end, bool(is_speech)] for start, end, is_speech in
+               zip(starts, starts[1:] + [duration], speech[np.concatenate(([0], changes))])]
+        ivs = combine_intervals(cut_short_intervals(ivs, False, min_sil_duration), True)
+        ivs = combine_intervals(cut_short_intervals(ivs, True, min_snd_duration), False)
+
+    speech_chunks = []
+    for start, end, is_speech in ivs:
+        if not is_speech:
+            continue
+        lo, hi = np.searchsorted(times, start, 'left'), np.searchsorted(times, end, 'right')
+        chunkvalues = values[lo:hi].tolist()
+        if not chunkvalues:
+            chunkvalues = [float(values[min(lo, len(values) - 1)])]
+        meandb = sum(chunkvalues) / len(chunkvalues)
+        iv = tgt.Interval(start, end, str(meandb))
+        iv.as_db = meandb
+        speech_chunks.append(iv)
+    return speech_chunks
 
 
 def filter_chunks(speech_chunks, silencelevel, speechthresh=0.8):
@@ -135,19 +342,24 @@ def filter_chunks(speech_chunks, silencelevel, speechthresh=0.8):
 
 
 def segment_speech(infile, outfile, wavfile, channel, filtertiername, shiftonset, shiftoffset, denoise,
-                   trainbegin, trainwindow, speechthresh, snradd):
+                   trainbegin, trainwindow, speechthresh, snradd, denoisewindow, denoisemaxfreq, denoisesmoothing):
     logging.info("Segmenting speech in %s" % wavfile)
     duration, _ = util.get_wav_duration(wavfile)
     tg, tier = util.init_textgrid(infile, duration, "seg.speech")
 
     logging.info("Floor estimation...")
-    _, intensities = segment_speech_praat(wavfile, channel,
-                                          denoise=denoise, trainbegin=trainbegin, trainwindow=trainwindow)
+    if denoise:
+        params = dict(VAD_DENOISE_PARAMS, windowlength=denoisewindow, maxfreq=denoisemaxfreq,
+                      smoothing=denoisesmoothing)
+        with denoised_channel(wavfile, channel, trainbegin, trainwindow, params) as denoised:
+            intensities = measure_intensity(denoised, 1)
+    else:
+        intensities = measure_intensity(wavfile, channel)
     silencelevel = find_silence_level(intensities, trainwindow) + snradd
     logging.info("estimated floor noise level: %s" % silencelevel)
     logging.info("Segmentation...")
-    speech_chunks, intensities = segment_speech_praat(wavfile, channel, threshold=silencelevel,
-                                                      denoise=denoise, trainbegin=trainbegin, trainwindow=trainwindow)
+    # the intensity contour does not depend on the threshold, chunk it again instead of rerunning the vad
+    speech_chunks = detect_speech_chunks(intensities, silencelevel, duration)
     for iv in speech_chunks:
         tier.add_annotation(iv)
 
@@ -207,8 +419,7 @@ def segment_speech(infile, outfile, wavfile, channel, filtertiername, shiftonset
 
     tier.name = "seg.speech"
     tg.add_tier(tier)
-    logging.info("Writing %s" % outfile)
-    tgt.io.write_to_file(textgrid=tg, filename=outfile, format="long")
+    util.write_textgrid(tg, outfile)
 
 
 def add_tier(infile, outfile, wavfile, mode, sourcetier, filtertier, desttier, text, pattern):
@@ -217,7 +428,6 @@ def add_tier(infile, outfile, wavfile, mode, sourcetier, filtertier, desttier, t
     logging.info("Adding tier using mode: " + mode)
     duration, _ = util.get_wav_duration(wavfile)
     tg, tier = util.init_textgrid(infile, duration, desttier)
-    duration, _ = util.get_wav_duration(wavfile)
     tier.start_time = 0
     tier.end_time = duration
     if mode == "trim":
@@ -242,8 +452,7 @@ def add_tier(infile, outfile, wavfile, mode, sourcetier, filtertier, desttier, t
                     tier.add_annotation(tgt.Annotation(overlapseg.start_time,
                                                        min(overlaps[-1].end_time+0.5, overlapseg.end_time), text))
     tg.add_tier(tier)
-    logging.info("Writing %s" % outfile)
-    tgt.io.write_to_file(textgrid=tg, filename=outfile, format="long")
+    util.write_textgrid(tg, outfile)
 
 
 def load_dict(filename):
@@ -255,6 +464,19 @@ def load_dict(filename):
     return pdict
 
 
+def load_dict_cached(filename):
+    """
+    :return: a copy of the dictionary, the file is only read again after it changed
+    """
+    st = os.stat(filename)
+    key = (st.st_mtime_ns, st.st_size)
+    entry = dict_cache.get(filename)
+    if entry is None or entry[0] != key:
+        entry = (key, load_dict(filename))
+        dict_cache[filename] = entry
+    return dict(entry[1])
+
+
 def save_dict(pdict, filename):
     with open(filename, 'w') as dictfile:
         dictwriter = csv.writer(dictfile, delimiter=';', quoting=csv.QUOTE_NONE, lineterminator="\n")
@@ -262,13 +484,13 @@ def save_dict(pdict, filename):
             dictwriter.writerow([key, val])
 
 
-def get_phonetic_transcriptions(tmpdir, segtier, annotier, language):
+def get_phonetic_transcriptions(segtier, annotier, language):
     intervalcnt = 0
     logging.info("Preparing transcription dictionary")
     pdict = {}
     cachefilename = os.path.join(cachedir, "aligntool.%s.cache" % language)
     if os.path.exists(cachefilename):
-        pdict = load_dict(cachefilename)
+        pdict = load_dict_cached(cachefilename)
 
     missing_kan = set()
     for speechseg in segtier.intervals:
@@ -285,150 +507,305 @@ def get_phonetic_transcriptions(tmpdir, segtier, annotier, language):
                     missing_kan.add(w)
     logging.info("%s missing phonetic transcriptions" % len(missing_kan))
     if len(missing_kan) > 0:
-        lexfile = os.path.join(tmpdir, "lexicon.txt")
-        txtout = open(lexfile, 'w')
-        for w in missing_kan:
-            print(w, file=txtout)
-        txtout.close()
-        g2pscript = os.path.join(os.path.dirname(sys.argv[0]), "rung2pwebservice.sh")
-        util.call_check([g2pscript, lexfile, language])
-        lextransfile = os.path.join(tmpdir, "lexicon.tab")
-        newdictlines = open(lextransfile, 'r').readlines()
-        for w, response in zip(missing_kan, newdictlines):
-            responsew, responset = response[:-1].split(';')
-            assert responset != "", "word '%s' was mapped to empty string. Invalid chars?" % w
-            if w != responsew:
-                logging.warning("g2p expanded %s to %s" % (w, responsew))
-            pdict[w] = "".join(responset.split(" "))
-        save_dict(pdict, cachefilename)
+        pdict.update(g2p.transcribe(missing_kan, language))
+        with dict_lock:
+            # concurrent alignments may have extended the cache in the meantime
+            if os.path.exists(cachefilename):
+                cached = load_dict_cached(cachefilename)
+                cached.update(pdict)
+                pdict = cached
+            save_dict(pdict, cachefilename)
+            st = os.stat(cachefilename)
+            dict_cache[cachefilename] = ((st.st_mtime_ns, st.st_size), dict(pdict))
     return pdict
 
 
-def split_utterances(tmpdir, speechtiername, infile, wavfile, channel, denoise):
+def split_utterances(tmpdir, speechtier, wavfile):
     logging.info("Splitting audio into utterance segments")
-    splitaudioscript = os.path.join(os.path.dirname(sys.argv[0]), "splitaudio.praat")
-    if denoise:
-        logging.warning("Assuming 1-4 seconds are non-speech for denoising")
-    result = util.call_check(["praat", "--run", splitaudioscript, os.path.realpath(wavfile), os.path.realpath(infile),
-                              "%s/iv" % tmpdir, str(channel), speechtiername, str(int(denoise))], True)
+    wav = audio.open_wav(wavfile)
     offsets = []
-    for line in result.decode().split("\n"):
-        items = line.split("\t")
-        if len(items) == 3:
-            foffset = tgt.Interval(start_time=float(items[0]), end_time=float(items[1]), text=items[2])
-            offsets.append(foffset)
+    for siv in speechtier:
+        if siv.text != "speech":
+            continue
+        foffset = tgt.Interval(start_time=siv.start_time, end_time=siv.end_time,
+                               text="%s/iv%s.wav" % (tmpdir, len(offsets) + 1))
+        foffset.samples = wav.sample_range(siv.start_time, siv.end_time)
+        offsets.append(foffset)
     logging.info("Split completed: %s segments" % len(offsets))
     return offsets
 
 
-def parse_maus_par(parfilename, sample_rate):
-    ort_ivs = []
-    mau_ivs = []
+def write_utterances(wavfile, channel, offsets, mausoptions):
+    """
+    Writes audio and MAUS input (foffset.bpf) of the utterances to be aligned. Utterances whose audio and
+    transcription were aligned before with the same MAUS options get the cached MAUS result instead, MAUS skips them.
+    :param mausoptions: everything besides audio and transcription that affects the MAUS result
+    :return: number of utterances left for MAUS
+    """
+    # only utterances with a transcription are aligned, the others are never written
+    wav = audio.open_wav(wavfile)
+    todo, hits = 0, 0
+    for foffset in offsets:
+        if not foffset.transcription_valid:
+            continue
+        start, end = foffset.samples
+        pcm16 = wav.pcm16(channel, start, end)
+        parfile = os.path.splitext(foffset.text)[0] + ".par"
+        digest = hashlib.sha1(pcm16.tobytes())
+        digest.update(foffset.bpf.encode())
+        digest.update(repr((wav.samplerate, mausoptions)).encode())
+        foffset.mauscache = os.path.join(cachedir, "aligntool.maus", "%s.par" % digest.hexdigest())
+        try:
+            shutil.copyfile(foffset.mauscache, parfile)
+            # the modification time of an entry is its last use, see prune_maus_cache
+            os.utime(foffset.mauscache)
+            foffset.mauscache = None
+            hits += 1
+        except FileNotFoundError:
+            with open(parfile, 'w') as f:
+                f.write(foffset.bpf)
+            audio.write_wav(foffset.text, pcm16, wav.samplerate)
+            todo += 1
+    logging.info("MAUS results of %s utterances found in cache" % hits)
+    return todo
+
+
+def cache_maus_results(offsets):
+    stored = 0
+    for foffset in offsets:
+        if not foffset.transcription_valid or foffset.mauscache is None:
+            continue
+        parfile = os.path.splitext(foffset.text)[0] + ".par"
+        with open(parfile, 'r') as f:
+            # failed alignments are retried next time
+            if not any(line.startswith("MAU:") for line in f):
+                continue
+        os.makedirs(os.path.dirname(foffset.mauscache), exist_ok=True)
+        # write and rename, parallel runs may store the same result
+        tmpfile = "%s.%s.tmp" % (foffset.mauscache, os.getpid())
+        shutil.copyfile(parfile, tmpfile)
+        os.replace(tmpfile, foffset.mauscache)
+        stored += 1
+    if stored > 0:
+        prune_maus_cache(os.path.join(cachedir, "aligntool.maus"), maus_cache_limit)
+
+
+def prune_maus_cache(directory, limit):
+    """
+    Removes the least recently used MAUS results until the cache is at most limit MB.
+    """
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(".par"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(x[1] for x in entries)
+    maxbytes = limit * 1024 * 1024
+    if total <= maxbytes:
+        return
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= maxbytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # removed by a parallel run
+            pass
+        total -= size
+        removed += 1
+    logging.info("Removed %s MAUS results from the cache, %.1f MB left" % (removed, total / 1024.0 / 1024.0))
+
+
+MausPar = namedtuple("MausPar", ["words", "word_begin", "word_end", "labels", "begin", "end"])
+
+
+def parse_maus_par(parfilename):
+    """
+    Reads the ORT and MAU tiers of a MAUS result.
+    :return: MausPar with the word and segment boundaries as sample offsets into the utterance, or None if the file
+             holds no alignment
+    """
+    words, maus = [], []
     with open(parfilename, 'r') as parfile:
-        # print(parfilename)
-        parreader = csv.reader(parfile, delimiter='\t', quotechar=None)
-        for row in parreader:
-            if row[0] == "ORT:":
-                oiv = tgt.Interval(0, 0, row[2])
-                oiv.has_begin_set = False
-                ort_ivs.append(oiv)
-                assert len(ort_ivs) == int(row[1]) + 1
-            elif row[0] == "MAU:":
-                ivbegin = float(row[1]) / sample_rate
-                ivend = (float(row[1]) + float(row[2]) + 1) / sample_rate
-                wnum = int(row[3])
-                # print(wnum, ivbegin, ivend, row[4])
-                ort_ivs[wnum].end_time = ivend
-                if wnum >= 0 and not ort_ivs[wnum].has_begin_set:
-                    ort_ivs[wnum].start_time = ivbegin
-                    ort_ivs[wnum].has_begin_set = True
-                mau_ivs.append(tgt.Interval(ivbegin, ivend, row[4]))
-    if not mau_ivs:
-        return [], []
-    for iv in ort_ivs:
-        assert iv.has_begin_set, "Incomplete MAU tier in %s" % parfilename
-    return ort_ivs, mau_ivs
+        for line in parfile:
+            if line.startswith("ORT:"):
+                words.append(line.rstrip("\r\n").split("\t")[2])
+            elif line.startswith("MAU:"):
+                maus.append(line.rstrip("\r\n").split("\t"))
+    if not maus:
+        return None
+    begin = np.array([row[1] for row in maus], dtype=np.float64)
+    end = begin + np.array([row[2] for row in maus], dtype=np.float64) + 1
+    wnum = np.array([row[3] for row in maus], dtype=np.int64)
+    # words span from the first to the last of their segments, pauses (word number -1) belong to no word
+    inword = wnum >= 0
+    assert (wnum < len(words)).all(), "MAU segment refers to an unknown word in %s" % parfilename
+    word_begin = np.full(len(words), np.inf)
+    word_end = np.full(len(words), -np.inf)
+    np.minimum.at(word_begin, wnum[inword], begin[inword])
+    np.maximum.at(word_end, wnum[inword], end[inword])
+    assert np.isfinite(word_begin).all(), "Incomplete MAU tier in %s" % parfilename
+    return MausPar(words, word_begin, word_end, [row[4] for row in maus], begin, end)
+
+
+def read_maus_par(parfile):
+    try:
+        return parse_maus_par(parfile)
+    except IOError:
+        return None
+    except:
+        logging.error("Exception while parsing MAUS result %s" % parfile)
+        raise
 
 
 def read_maus_alignments(tmpdir, offsets, orttier, mautier, sample_rate):
     logging.info("Reading MAUS alignments")
-    for i, foffset in enumerate(offsets):
-        intervalcnt = i+1
-        parfile = "%s/iv%s.par" % (tmpdir, intervalcnt)
-        try:
-            ort_ivs, mau_ivs = parse_maus_par(parfile, sample_rate)
-            if not ort_ivs and foffset.transcription_valid:
-                logging.warning("No alignment imported for interval %s: %s" % (intervalcnt, foffset))
-            for iv in ort_ivs:
-                orttier.add_annotation(tgt.Interval(iv.start_time + foffset.start_time,
-                                                    iv.end_time + foffset.start_time, iv.text))
-            for iv in mau_ivs:
-                mautier.add_annotation(tgt.Interval(iv.start_time + foffset.start_time,
-                                                    iv.end_time + foffset.start_time, iv.text))
-        except IOError:
+    parfiles = ["%s/iv%s.par" % (tmpdir, i + 1) for i in range(len(offsets))]
+    with ThreadPoolExecutor(max_workers=min(8, max(len(parfiles), 1))) as executor:
+        results = list(executor.map(read_maus_par, parfiles))
+    ort_ivs, mau_ivs = [], []
+    for i, (foffset, par) in enumerate(zip(offsets, results)):
+        if par is None:
             if foffset.transcription_valid:
-                logging.warning("No alignment imported for interval %s: %s" % (intervalcnt, foffset))
-        except:
-            logging.error("Exception while parsing TextGrid %s" % parfile)
-            raise
-
-
-def generate_maus_transcriptions(tmpdir, segtier, offsets, annotier, pdict):
+                logging.warning("No alignment imported for interval %s: %s" % (i + 1, foffset))
+            continue
+        # sample offsets within the utterance to times in the recording
+        word_begin = (par.word_begin / sample_rate + foffset.start_time).tolist()
+        word_end = (par.word_end / sample_rate + foffset.start_time).tolist()
+        begin = (par.begin / sample_rate + foffset.start_time).tolist()
+        end = (par.end / sample_rate + foffset.start_time).tolist()
+        ort_ivs.extend(tgt.Interval(*iv) for iv in zip(word_begin, word_end, par.words))
+        mau_ivs.extend(tgt.Interval(*iv) for iv in zip(begin, end, par.labels))
+    orttier.add_annotations(ort_ivs)
+    mautier.add_annotations(mau_ivs)
+
+
+def generate_maus_transcriptions(segtier, offsets, annotier, pdict):
+    """
+    Assembles the MAUS input (BPF with ORT and KAN tiers) of each utterance in foffset.bpf. Offsets, segmentation
+    and annotation are sorted and non-overlapping, so they are joined in a single sweep.
+    """
     logging.info("Generating transcriptions for MAUS alignment")
-    for intervalcnt, foffset in enumerate(offsets):
+    # the sweep gives the same intervals as tgt's range queries (bisect) only for ordered offsets
+    assert all(a.start_time <= a.end_time <= b.start_time for a, b in zip(offsets, offsets[1:])), \
+        "utterances are not sorted or overlap"
+    segs, annos = segtier.intervals, annotier.intervals
+    iseg, ianno = 0, 0
+    for foffset in offsets:
         foffset.transcription_valid = False
-        seg_ivs = segtier.get_annotations_between_timepoints(foffset.start_time, foffset.end_time,
-                                                             left_overlap=True, right_overlap=True)
-        seg_ivs = [x for x in seg_ivs if x.text == "speech"]
+        # pre-segmentation intervals overlapping the utterance
+        while iseg < len(segs) and segs[iseg].end_time <= foffset.start_time:
+            iseg += 1
+        seg_ivs = []
+        j = iseg
+        while j < len(segs) and segs[j].start_time < foffset.end_time:
+            if segs[j].text == "speech":
+                seg_ivs.append(segs[j])
+            j += 1
         assert len(seg_ivs) <= 1, "Invalid segmentation hierarchy: %s is overlap-contained by multiple " \
                                   "pre-segmentation intervals %s" % (foffset, seg_ivs)
         if not seg_ivs:
             logging.warning("%s does not seem to correspond to any pre-segmentation interval" % foffset)
             continue
         seg_iv = seg_ivs[0]
-        assert seg_iv.text == "speech", "speech interval %s contained by non-speech pre-segmentation %s" % (foffset, seg_iv)
-        wordsegments = annotier.get_annotations_between_timepoints(seg_iv.start_time, seg_iv.end_time,
-                                                                   left_overlap=True, right_overlap=True)
+        # annotations overlapping the pre-segmentation interval
+        while ianno < len(annos) and annos[ianno].end_time <= seg_iv.start_time:
+            ianno += 1
+        wordsegments = []
+        j = ianno
+        while j < len(annos) and annos[j].start_time < seg_iv.end_time:
+            wordsegments.append(annos[j])
+            j += 1
         if len(wordsegments) == 0:
             logging.warning("Ignoring empty annotation for interval %s" % seg_iv)
             continue
         foffset.transcription_valid = True
-        txtout = open("%s/iv%s.par" % (tmpdir, intervalcnt+1), 'w')
         words = " ".join([x.text for x in wordsegments]).split()
-        for i, w in enumerate(words):
-            print("ORT:\t%s\t%s" % (i, w), file=txtout)
-        for i, w in enumerate(words):
-            print("KAN:\t%s\t%s" % (i, pdict[w]), file=txtout)
-        txtout.close()
-
-
-def align_maus(infile, wavfile, outfile, denoise, channel, segtiername, filtertiername, initialsilence, remote,
-               language):
+        foffset.bpf = "".join(["ORT:\t%s\t%s\n" % (i, w) for i, w in enumerate(words)] +
+                              ["KAN:\t%s\t%s\n" % (i, pdict[w]) for i, w in enumerate(words)])
+
+
+def get_maus_executor():
+    """
+    Local MAUS runs of all files aligned in this process share one pool, sized to the machine. In a batch, the
+    utterances of all files being aligned are queued there, so a file with few utterances does not leave cores idle.
+    """
+    global maus_executor
+    with maus_executor_lock:
+        if maus_executor is None:
+            maus_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        return maus_executor
+
+
+def run_maus_utterance(mausbin, wavfile, nosil, language):
+    prefix = os.path.splitext(wavfile)[0]
+    with open("%s.log" % prefix, 'w') as logfile:
+        returncode = subprocess.call([mausbin, "v=0", "OUT=%s.par" % prefix, "OUTFORMAT=mau-append",
+                                      "SIGNAL=%s" % wavfile, "BPF=%s.par" % prefix, "USETRN=no",
+                                      "NOINITIALFINALSILENCE=%s" % nosil, "LANGUAGE=%s" % language],
+                                     stdout=logfile, stderr=subprocess.STDOUT, env=dict(os.environ, LC_ALL="C"))
+    if returncode != 0:
+        # like a missing alignment, the utterance is reported when the results are read
+        with open("%s.log" % prefix, 'r') as logfile:
+            logging.warning("Error/Warning processing %s:\n%s" % (wavfile, logfile.read()))
+
+
+def run_maus_local(mausbin, offsets, initialsilence, language):
+    nosil = "no" if initialsilence else "yes"
+    wavfiles = [x.text for x in offsets if x.transcription_valid and x.mauscache is not None]
+    logging.info("exec[]: %s on %s utterances" % (mausbin, len(wavfiles)))
+    executor = get_maus_executor()
+    futures = [executor.submit(run_maus_utterance, mausbin, wavfile, nosil, language) for wavfile in wavfiles]
+    for future in futures:
+        future.result()
+
+
+def align_maus(infile, wavfile, outfile, denoise, trainbegin, trainwindow, channel, segtiername, filtertiername,
+               initialsilence, remote, language, denoisewindow, denoisemaxfreq, denoisesmoothing):
     logging.info("Aligning %s based on segmentation in %s" % (wavfile, infile))
-    tmpdir = tempfile.mkdtemp()
+    tmpdir = tempfile.mkdtemp(dir=audio.ram_tmpdir())
     try:
-        duration, _ = util.get_wav_duration(wavfile)
+        duration, sample_rate = util.get_wav_duration(wavfile)
         tg, orttier, mautier = util.init_textgrid(infile, duration, "maus.ort", "maus.pho")
         annotier = tg.get_tier_by_name("anno.trans")
         segtier = tg.get_tier_by_name(filtertiername)
 
-        pdict = get_phonetic_transcriptions(tmpdir, segtier, annotier, language)
-        offsets = split_utterances(tmpdir, segtiername, infile, wavfile, channel, denoise)
-        generate_maus_transcriptions(tmpdir, segtier, offsets, annotier, pdict)
-
-        logging.info("Performing MAUS alignment")
-        if not os.path.exists(os.path.join(os.path.dirname(sys.argv[0]), "..", "external", "maus")):
+        pdict = get_phonetic_transcriptions(segtier, annotier, language)
+        offsets = split_utterances(tmpdir, tg.get_tier_by_name(segtiername), wavfile)
+        generate_maus_transcriptions(segtier, offsets, annotier, pdict)
+        mausbin = os.path.join(os.path.dirname(sys.argv[0]), "..", "external", "maus", "maus")
+        if not os.path.exists(os.path.dirname(mausbin)):
             mausscript = os.path.join(os.path.dirname(sys.argv[0]), "runmauswebservice.sh")
+            mausoptions = ("webservice", language, initialsilence)
+        else:
+            mausscript = None
+            mausoptions = ("local", language, initialsilence)
+        if denoise:
+            # same denoised channel as in segment_speech, if that ran with the same noise interval and filter
+            params = dict(MAUS_DENOISE_PARAMS, windowlength=denoisewindow, maxfreq=denoisemaxfreq,
+                          smoothing=denoisesmoothing)
+            with denoised_channel(wavfile, channel, trainbegin, trainwindow, params) as denoised:
+                todo = write_utterances(denoised, 1, offsets, mausoptions)
         else:
-            mausscript = os.path.join(os.path.dirname(sys.argv[0]), "runmauslocal.sh")
-        util.call_check([mausscript, tmpdir, str(not initialsilence), language])
+            todo = write_utterances(wavfile, channel, offsets, mausoptions)
+
+        if todo > 0:
+            logging.info("Performing MAUS alignment of %s utterances" % todo)
+            if mausscript is None:
+                run_maus_local(mausbin, offsets, initialsilence, language)
+            else:
+                util.call_check([mausscript, tmpdir, str(not initialsilence), language])
+            cache_maus_results(offsets)
 
-        duration, sample_rate = util.get_wav_duration(wavfile)
         read_maus_alignments(tmpdir, offsets, orttier, mautier, sample_rate)
         tg.add_tier(orttier)
         tg.add_tier(mautier)
-        logging.info("Writing %s" % outfile)
-        tgt.io.write_to_file(textgrid=tg, filename=outfile, format="long")
+        util.write_textgrid(tg, outfile)
     except:
         logging.error("Exception while running maus alignment. Retained temp dir: %s" % tmpdir)
         raise
@@ -436,6 +813,87 @@ def align_maus(infile, wavfile, outfile, denoise, channel, segtiername, filterti
         shutil.rmtree(tmpdir)
 
 
+PIPELINE_STAGES = ("segmentBeeps", "addTier", "segmentSpeech", "alignMAUS")
+
+
+# stand-ins for the per-row files while parsing the options of a stage
+STAGE_OUTFILE = "\0outfile"
+STAGE_WAVFILE = "\0wavfile"
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_stage(stage, parser_class):
+    """
+    Parses the options of a stage once per distinct argument vector, independent of the files of a row.
+    :param stage: tuple of the command name and its options
+    """
+    return parse_arguments(list(stage[:1]) + ['-o', STAGE_OUTFILE, '-w', STAGE_WAVFILE] + list(stage[1:]),
+                           get_parser(parser_class, prog="pipeline"))
+
+
+def parse_pipeline(infile, outfile, wavfile, stages, parser_class=None):
+    """
+    :param stages: list of argument vectors, each starting with the stage's command name
+    :return: parsed arguments of the stages, with -i/-o/-w filled in
+    """
+    if parser_class is None:
+        parser_class = argparse.ArgumentParser
+    stageargs = []
+    for i, stage in enumerate(stages):
+        assert len(stage) > 0 and stage[0] in PIPELINE_STAGES, \
+            "invalid pipeline stage '%s', expected one of %s" % (" ".join(stage), ", ".join(PIPELINE_STAGES))
+        args = argparse.Namespace(**vars(parse_stage(tuple(stage), parser_class)))
+        # all but the first stage read the previous stage's result from memory, options given with the stage win
+        if args.infile is None:
+            args.infile = infile if i == 0 else outfile
+        if args.outfile == STAGE_OUTFILE:
+            args.outfile = outfile
+        if args.wavfile == STAGE_WAVFILE:
+            args.wavfile = wavfile
+        stageargs.append(args)
+    return stageargs
+
+
+def check_channels(stageargs, wavfile):
+    """
+    Fails early if a stage uses a channel the recording does not have.
+    """
+    nchannels = audio.probe(wavfile).nchannels
+    for args in stageargs:
+        for option in ("channel", "beepchannel"):
+            channel = getattr(args, option, None)
+            if channel is not None and not 1 <= channel <= nchannels:
+                raise ValueError("%s uses %s %s, but %s has %s channels" % (
+                    args.cmd.__name__, option, channel, wavfile, nchannels))
+
+
+def run_pipeline(infile, outfile, wavfile, stages, checkpoint=False, parser_class=None):
+    """
+    Runs several TextGrid processing stages on one file, keeping the TextGrid (and the decoded audio) in memory
+    between the stages. Only the final TextGrid is written, plus one checkpoint per stage if requested.
+    :param stages: list of argument vectors, each starting with the stage's command name
+    :return: list of (command name, seconds) of the stages
+    """
+    stageargs = parse_pipeline(infile, outfile, wavfile, stages, parser_class)
+    check_channels(stageargs, wavfile)
+    timings = []
+    with util.MemoryTextGrids() as textgrids:
+        for stage, args in zip(stages, stageargs):
+            logging.info("Pipeline stage: %s" % " ".join(stage))
+            started = time.time()
+            args.cmd(**util.extract_args(args))
+            timings.append((stage[0], time.time() - started))
+            if checkpoint:
+                util.write_textgrid(textgrids[outfile], outfile, force=True)
+        if not checkpoint:
+            util.write_textgrid(textgrids[outfile], outfile, force=True)
+    return timings
+
+
+def pipeline(infile, outfile, wavfile, stages, checkpoint):
+    run_pipeline(infile, outfile, wavfile, [shlex.split(x) for x in stages], checkpoint)
+
+
 class DumpRecord:
     pass
 
@@ -568,6 +1026,15 @@ def add_textgrid_options(parser):
                         help='output TextGrid')
 
 
+def add_denoise_options(parser, defaults):
+    parser.add_argument("--denoise-window", dest='denoisewindow', metavar='<s>', action='store', type=float,
+                        default=defaults["windowlength"], help='window length of the spectral subtraction')
+    parser.add_argument("--denoise-maxfreq", dest='denoisemaxfreq', metavar='<hz>', action='store', type=float,
+                        default=defaults["maxfreq"], help='frequencies above <hz> are removed by denoising')
+    parser.add_argument("--denoise-smoothing", dest='denoisesmoothing', metavar='<hz>', action='store', type=float,
+                        default=defaults["smoothing"], help='width of the flanks of the denoising band filter')
+
+
 def add_language_options(parser):
     langs = ["deu-DE", "gsw-CH", "eng-GB", "fin-FI", "fra-FR", "eng-AU", "eng-US",
              "nld-NL", "spa-ES", "ita-IT", "por-PT", "hun-HU", "ekk-EE", "pol-PL",
@@ -576,7 +1043,29 @@ def add_language_options(parser):
                         required=False, choices=langs, default="deu-DE", help='language code')
 
 
-def parse_arguments(argv, parser=argparse.ArgumentParser(prog=os.path.basename(__file__), add_help=True)):
+def get_parser(parser_class=None, prog=os.path.basename(__file__)):
+    """
+    :return: the command line parser with all subcommands, built once per parser class and program name
+    """
+    if parser_class is None:
+        parser_class = argparse.ArgumentParser
+    key = (parser_class, prog)
+    with parser_lock:
+        if key not in parsers:
+            parsers[key] = build_parser(parser_class(prog=prog, add_help=True))
+        return parsers[key]
+
+
+def parse_arguments(argv, parser=None):
+    """
+    :param parser: parser from get_parser(), the default one if not given
+    """
+    if parser is None:
+        parser = get_parser()
+    return parser.parse_args(argv)
+
+
+def build_parser(parser):
     sub_cmd_parser = parser.add_subparsers(dest='cmd', title='subcommands (-h for more help)')
     sub_cmd_parser.required = True
 
@@ -622,7 +1111,12 @@ def parse_arguments(argv, parser=argparse.ArgumentParser(prog=os.path.basename(_
     segment_speech_parser.add_argument('-f', "--filter-tier", dest='filtertiername', metavar='<tier>', action='store',
                                        required=False,
                                        help='filter/suppress speech intervals based on existing speech interval tier')
-    segment_speech_parser.add_argument("-d", "--denoise", dest='denoise', action='store_true', help='enable denoising')
+    segment_speech_parser.add_argument("-d", "--denoise", dest='denoise', action='store_true',
+                                       help='enable denoising. Spectral subtraction with the settings of the former '
+                                            'praat script, computed in python, so results may differ slightly from '
+                                            'older versions. Shared with alignMAUS -d if noise interval and '
+                                            'denoising options are the same')
+    add_denoise_options(segment_speech_parser, VAD_DENOISE_PARAMS)
     segment_speech_parser.add_argument('--shiftonsets', dest='shiftonset', metavar='<s>', action='store', type=float,
                                        default=0,
                                        required=False, help='shift detected onsets by <s> seconds')
@@ -692,7 +1186,18 @@ def parse_arguments(argv, parser=argparse.ArgumentParser(prog=os.path.basename(_
     align_maus_parser.add_argument('-s', "--segmentation-tier", dest='segtiername', metavar='<tier>', action='store',
                                    default="seg.beep",
                                    help='<tier> providing speech segmentation')
-    align_maus_parser.add_argument("-d", "--denoise", dest='denoise', action='store_true', help='enable denoising')
+    align_maus_parser.add_argument("-d", "--denoise", dest='denoise', action='store_true',
+                                   help='enable denoising. Spectral subtraction with the noise interval and settings '
+                                        'of the former praat script, computed in python, so results may differ '
+                                        'slightly from older versions. Shared with segmentSpeech -d if noise interval '
+                                        'and denoising options are the same')
+    align_maus_parser.add_argument('--trainbegin', dest='trainbegin', metavar='<s>', action='store', type=float,
+                                   default=0,
+                                   help='noise interval for denoising starts at <s> seconds')
+    align_maus_parser.add_argument('--trainwindow', dest='trainwindow', metavar='<s>', action='store', type=float,
+                                   default=3,
+                                   help='length of the noise interval for denoising in seconds')
+    add_denoise_options(align_maus_parser, MAUS_DENOISE_PARAMS)
     align_maus_parser.add_argument("--initialsilence", dest='initialsilence', action='store_true',
                                    help='enable initial and final silence models')
     align_maus_parser.add_argument("--remote", dest='remote', action='store_true',
@@ -726,18 +1231,127 @@ def parse_arguments(argv, parser=argparse.ArgumentParser(prog=os.path.basename(_
     export_boundaries_parser.add_argument('-f', "--filter-tier", dest='filtertiername', metavar='<tier>', action='store',
                                           default="seg.beep",
                                           help='pre-segmentation tier')
+    pipeline_parser = sub_cmd_parser.add_parser('pipeline',
+                                                help='run several stages on one file, keeping intermediate results in '
+                                                     'memory',
+                                                formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    pipeline_parser.set_defaults(cmd=pipeline)
+    add_textgrid_options(pipeline_parser)
+    pipeline_parser.add_argument('-w', "--wav-file", dest='wavfile', metavar='<wavfile>', action='store',
+                                 required=True, help='input wav file')
+    pipeline_parser.add_argument('-s', "--stage", dest='stages', metavar='<stage>', action='append', required=True,
+                                 help='stage command with its options, e.g. "segmentBeeps -r beep.wav". Stages are '
+                                      'run in the given order, -i/-o/-w are filled in automatically')
+    pipeline_parser.add_argument("--checkpoint", dest='checkpoint', action='store_true',
+                                 help='write the TextGrid after each stage, not only after the last one')
+
     gui_parser = sub_cmd_parser.add_parser('gui', help='open a simple graphical user interface',
                                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    gui_parser.set_defaults(cmd=gui.setup)
+    gui_parser.set_defaults(cmd=run_gui)
 
-    args = parser.parse_args(argv)
-    return args
+    serve_parser = sub_cmd_parser.add_parser('serve', help='keep a process with warm caches running and execute '
+                                                           'commands sent by aligntoolclient.py',
+                                             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    serve_parser.set_defaults(cmd=serve)
+    serve_parser.add_argument('-S', "--socket", dest='socketpath', metavar='<socket>', action='store',
+                              default=DEFAULT_SOCKET, help='unix socket to listen on')
+    return parser
+
+
+def run_gui():
+    # PyQt5 is only loaded when the gui is actually used
+    import gui
+    gui.setup()
+
+
+class JobOutput:
+    """
+    File-like object forwarding the output of a job to the client, one json message per write.
+    """
+
+    def __init__(self, wfile, lock, key):
+        self.wfile = wfile
+        self.lock = lock
+        self.key = key
+
+    def send(self, value):
+        with self.lock:
+            self.wfile.write((json.dumps({self.key: value}) + "\n").encode())
+            self.wfile.flush()
+
+    def write(self, text):
+        if text:
+            self.send(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    Runs one command per connection. The request is a json object with the argument vector and the working
+    directory of the client, the answer is a stream of json messages with stdout/stderr output, the last one holds
+    the exit code.
+    """
+
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode())
+        lock = threading.Lock()
+        out, err = JobOutput(self.wfile, lock, "out"), JobOutput(self.wfile, lock, "err")
+        # jobs change the working directory and redirect the output, they run one at a time
+        with job_lock:
+            code = run_job(request["argv"], request["cwd"], out, err)
+        JobOutput(self.wfile, lock, "exit").send(code)
+
+
+def run_job(argv, cwd, out, err):
+    logger = logging.getLogger()
+    handler = logging.StreamHandler(err)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFORMAT))
+    logger.addHandler(handler)
+    servercwd = os.getcwd()
+    try:
+        os.chdir(cwd)
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            args = parse_arguments(argv)
+            if args.cmd in (serve, run_gui):
+                raise ValueError("%s cannot be run by the server" % argv[0])
+            args.cmd(**util.extract_args(args))
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception as e:
+        logging.exception("Job %s failed: %s" % (" ".join(argv), e))
+        return 1
+    finally:
+        os.chdir(servercwd)
+        logger.removeHandler(handler)
+
+
+def serve(socketpath):
+    """
+    Keeps this process running and executes the commands sent by aligntoolclient.py. Caches (pronunciation
+    dictionaries, reference beeps, workbooks, opened audio) stay warm and there is no startup cost per command.
+    """
+    if os.path.exists(socketpath):
+        os.remove(socketpath)
+    util.cache_workbooks = True
+    server = socketserver.ThreadingUnixStreamServer(socketpath, JobHandler)
+    logging.info("Serving on %s" % socketpath)
+    # leave through the finally block on termination as well, removing the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socketpath)
 
 
 def main():
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    formatter = logging.Formatter('-=%(levelname)s=- [%(asctime)s.%(msecs)d] %(message)s', datefmt='%H:%M:%S')
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFORMAT)
     handler = logging.StreamHandler(sys.stderr)
     handler.setFormatter(formatter)
     logger.addHandler(handler)
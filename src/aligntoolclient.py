@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+"""
+Thin client for "aligntool.py serve": sends its arguments to the server, prints the output of the command and
+exits with its exit code, e.g.
+    aligntoolclient.py segmentBeeps -o out.TextGrid -w in.wav -r beep.wav
+The socket is taken from ALIGNTOOL_SOCKET and defaults to the one of the server.
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+
+def main():
+    socketpath = os.environ.get("ALIGNTOOL_SOCKET",
+                                os.path.join(tempfile.gettempdir(), "aligntool.%s.sock" % os.getuid()))
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socketpath)
+    except OSError as e:
+        print("Unable to connect to aligntool server at %s: %s" % (socketpath, e), file=sys.stderr)
+        return 1
+    with conn, conn.makefile('rwb') as f:
+        f.write((json.dumps({"argv": sys.argv[1:], "cwd": os.getcwd()}) + "\n").encode())
+        f.flush()
+        for line in f:
+            message = json.loads(line.decode())
+            if "out" in message:
+                sys.stdout.write(message["out"])
+            elif "err" in message:
+                sys.stderr.write(message["err"])
+            elif "exit" in message:
+                return message["exit"]
+    print("Connection to aligntool server lost", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
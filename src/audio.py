@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import struct
+import threading
+import wave
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+
+WavHeader = namedtuple("WavHeader", ["nchannels", "sampwidth", "samplerate", "nframes", "fmt", "data_offset"])
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_header(filename):
+    """
+    Parses the RIFF chunks of a wav file without reading any sample data.
+    :param filename: wavfile
+    :return: WavHeader
+    """
+    filesize = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        riff, _, wavetag = struct.unpack("<4sI4s", f.read(12))
+        assert riff == b"RIFF" and wavetag == b"WAVE", "%s is not a RIFF/WAVE file" % filename
+        fmt = None
+        while True:
+            chunkhead = f.read(8)
+            assert len(chunkhead) == 8, "no data chunk found in %s" % filename
+            chunkid, chunksize = struct.unpack("<4sI", chunkhead)
+            if chunkid == b"fmt ":
+                fmtdata = f.read(chunksize)
+                fmttag, nchannels, samplerate, _, _, bits = struct.unpack("<HHIIHH", fmtdata[:16])
+                if fmttag == WAVE_FORMAT_EXTENSIBLE:
+                    fmttag = struct.unpack("<H", fmtdata[24:26])[0]
+                fmt = (fmttag, nchannels, samplerate, (bits + 7) // 8)
+            elif chunkid == b"data":
+                assert fmt is not None, "data chunk precedes fmt chunk in %s" % filename
+                fmttag, nchannels, samplerate, sampwidth = fmt
+                data_offset = f.tell()
+                # streamed recordings may carry a bogus data size, trust the file size instead
+                datasize = min(chunksize, filesize - data_offset)
+                nframes = datasize // (nchannels * sampwidth)
+                return WavHeader(nchannels, sampwidth, samplerate, nframes, fmttag, data_offset)
+            else:
+                f.seek(chunksize + (chunksize & 1), os.SEEK_CUR)
+
+
+class HeaderCache:
+    """
+    Wav headers by path, valid while size and modification time of the file are unchanged. The cache can be saved
+    and loaded, so headers probed once (e.g. by xlsbatch wavlist) are not read again by later runs.
+    """
+
+    def __init__(self):
+        self.headers = {}
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        key = [st.st_size, st.st_mtime_ns]
+        with self.lock:
+            entry = self.headers.get(path)
+        if entry is None or entry[0] != key:
+            entry = (key, read_header(path))
+            with self.lock:
+                self.headers[path] = entry
+        return entry[1]
+
+    def load(self, filename):
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r') as f:
+            entries = json.load(f)
+        with self.lock:
+            for path, (key, header) in entries.items():
+                self.headers.setdefault(path, (key, WavHeader(*header)))
+
+    def save(self, filename):
+        with self.lock:
+            entries = dict((path, (key, list(header))) for path, (key, header) in self.headers.items())
+        tmpfile = "%s.%s.tmp" % (filename, os.getpid())
+        with open(tmpfile, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmpfile, filename)
+
+
+headers = HeaderCache()
+
+
+def probe(filename):
+    """
+    :return: WavHeader of the file, from the header cache if the file is unchanged
+    """
+    return headers.get(filename)
+
+
+class WavFile:
+    """
+    Memory-mapped view on a PCM or float wav file. Sample data is only paged in from disk when a range of a channel
+    is actually accessed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = probe(filename)
+        self.nchannels = self.header.nchannels
+        self.samplerate = self.header.samplerate
+        self.nframes = self.header.nframes
+        self.duration = self.nframes / float(self.samplerate)
+        h = self.header
+        if h.fmt == WAVE_FORMAT_IEEE_FLOAT and h.sampwidth in (4, 8):
+            dtype, self.scale = "<f%d" % h.sampwidth, 1.0
+        elif h.fmt == WAVE_FORMAT_PCM and h.sampwidth == 1:
+            dtype, self.scale = "u1", 128.0
+        elif h.fmt == WAVE_FORMAT_PCM and h.sampwidth in (2, 4):
+            dtype, self.scale = "<i%d" % h.sampwidth, float(2 ** (8 * h.sampwidth - 1))
+        elif h.fmt == WAVE_FORMAT_PCM and h.sampwidth == 3:
+            dtype, self.scale = "u1", float(2 ** 23)
+        else:
+            raise ValueError("Unsupported wav format %s with %s bytes per sample in %s" % (h.fmt, h.sampwidth, filename))
+        if h.sampwidth == 3:
+            shape = (self.nframes, self.nchannels, 3)
+        else:
+            shape = (self.nframes, self.nchannels)
+        if self.nframes > 0:
+            self.frames = np.memmap(filename, dtype=dtype, mode='r', offset=h.data_offset, shape=shape)
+        else:
+            self.frames = np.zeros(shape, dtype=dtype)
+
+    def raw_channel(self, channel):
+        """
+        :param channel: 1-based channel number as used by praat
+        :return: strided view on the undecoded samples of the channel
+        """
+        assert 1 <= channel <= self.nchannels, "%s has no channel %s (%s channels)" % (
+            self.filename, channel, self.nchannels)
+        return self.frames[:, channel - 1]
+
+    def channel(self, channel, start=0, end=None):
+        """
+        :param channel: 1-based channel number as used by praat
+        :param start: first sample
+        :param end: sample after the last one
+        :return: float64 samples scaled to [-1, 1)
+        """
+        return self.decode(self.raw_channel(channel)[start:end])
+
+    def read_raw(self, channel, start=0, end=None):
+        """
+        Like raw_channel()[start:end], but the range is read from the file instead of being paged in through the
+        memory map. Pages touched through the map stay in the resident set of the process, streaming over a long
+        recording with plain reads keeps it bounded by the block size.
+        """
+        assert 1 <= channel <= self.nchannels, "%s has no channel %s (%s channels)" % (
+            self.filename, channel, self.nchannels)
+        start, end, _ = slice(start, end).indices(self.nframes)
+        count = max(end - start, 0)
+        framesize = self.nchannels * self.header.sampwidth
+        with open(self.filename, 'rb') as f:
+            f.seek(self.header.data_offset + start * framesize)
+            data = f.read(count * framesize)
+        frames = np.frombuffer(data, dtype=self.frames.dtype).reshape((count,) + self.frames.shape[1:])
+        return frames[:, channel - 1]
+
+    def read(self, channel, start=0, end=None):
+        """
+        :return: float64 samples of the channel range like channel(), read with read_raw()
+        """
+        return self.decode(self.read_raw(channel, start, end))
+
+    def decode(self, raw):
+        if self.header.sampwidth == 3:
+            raw = raw.astype(np.int32)
+            ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+            ints = np.where(ints >= 2 ** 23, ints - 2 ** 24, ints)
+            return ints / self.scale
+        if self.header.sampwidth == 1:
+            return (raw.astype(np.float64) - 128.0) / self.scale
+        return raw.astype(np.float64) / self.scale
+
+    def pcm16(self, channel, start=0, end=None):
+        """
+        :return: samples of the channel range as 16 bit pcm, copied without conversion if the file already is
+        """
+        if self.header.fmt == WAVE_FORMAT_PCM and self.header.sampwidth == 2:
+            return np.ascontiguousarray(self.read_raw(channel, start, end))
+        return float_to_pcm16(self.read(channel, start, end))
+
+    def sample_range(self, start_time, end_time):
+        """
+        Sample range whose sample centres lie within [start_time, end_time], the same way praat extracts parts.
+        """
+        start = max(int(np.ceil(start_time * self.samplerate - 0.5)), 0)
+        end = min(int(np.floor(end_time * self.samplerate - 0.5)) + 1, self.nframes)
+        return start, max(start, end)
+
+
+class AudioCache:
+    """
+    Keeps recently used wav files open, keyed by path and modification time, so that all stages running in one
+    process share the header and the memory-mapped channel data of a recording.
+    """
+
+    def __init__(self, maxfiles=8):
+        self.maxfiles = maxfiles
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.files.pop(path, None)
+            if entry is None or entry[0] != key:
+                logging.debug("Opening %s" % path)
+                entry = (key, WavFile(path))
+            self.files[path] = entry
+            while len(self.files) > self.maxfiles:
+                self.files.popitem(last=False)
+            return entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+
+
+cache = AudioCache()
+
+
+def open_wav(filename):
+    return cache.get(filename)
+
+
+def float_to_pcm16(samples):
+    return np.clip(np.round(samples * 32768.0), -32768, 32767).astype("<i2")
+
+
+def write_wav(filename, pcm16, samplerate):
+    write_wav_blocks(filename, [pcm16], samplerate)
+
+
+def write_wav_blocks(filename, blocks, samplerate):
+    """
+    Writes a mono 16 bit wav file from consecutive blocks of pcm16 samples, without holding all of them at once.
+    """
+    with wave.open(filename, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(samplerate)
+        for pcm16 in blocks:
+            f.writeframes(pcm16.astype("<i2", copy=False).tobytes())
+
+
+def ram_tmpdir():
+    """
+    :return: a memory backed directory for short lived temporary files, or None to use the system default
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    logging.debug("No memory backed temp dir available")
+    return None
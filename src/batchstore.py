@@ -0,0 +1,311 @@
+import contextlib
+import csv
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+
+from openpyxl import Workbook, load_workbook, comments
+from openpyxl.utils import get_column_letter
+
+import util
+
+# sheets of a batch, the same in both kinds of stores
+SHEETS = ("batch", "segments", "on_offsets")
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+# sqlite column holding the sheet row number
+ROW_COLUMN = "_row"
+
+
+def is_sqlite(filename):
+    return os.path.splitext(filename)[1].lower() in SQLITE_EXTENSIONS
+
+
+def open_store(filename, readonly=False):
+    """
+    :param filename: xlsx workbook or, by its extension, an SQLite batch store
+    :param readonly: the store is only read, a workbook is opened read-only (and cached by aligntool serve)
+    """
+    if is_sqlite(filename):
+        return SqliteStore(filename)
+    return XlsxStore(filename, readonly)
+
+
+def write_table(filename, sheet, header, rows):
+    """
+    Streams rows into a new file, a write-only workbook with a single sheet or csv by the extension. The file is
+    replaced when complete.
+    """
+    tmpfile = "%s.%s.tmp" % (filename, os.getpid())
+    if filename.lower().endswith(".csv"):
+        with open(tmpfile, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+    else:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=sheet)
+        # a write-only sheet needs its column widths before the first row, they are taken from the first rows
+        widths = ColumnWidths()
+        widths.update(header)
+        rows = iter(rows)
+        head = list(itertools.islice(rows, widths.sample - 1))
+        for row in head:
+            widths.update(row)
+        widths.apply(ws)
+        ws.append(list(header))
+        for row in itertools.chain(head, rows):
+            ws.append(row)
+        wb.save(tmpfile)
+    os.replace(tmpfile, filename)
+
+
+class ColumnWidths:
+    """
+    Column widths from the longest values, estimated while rows are written. All of the first rows are measured,
+    later ones only at a stride, so sizing stays cheap for large sheets.
+    """
+
+    def __init__(self, minwidth=20, sample=1000, stride=100):
+        self.minwidth = minwidth
+        self.sample = sample
+        self.stride = stride
+        self.count = 0
+        self.widths = {}
+
+    def update(self, values):
+        self.count += 1
+        if self.count > self.sample and self.count % self.stride != 0:
+            return
+        for c, value in enumerate(values):
+            if value:
+                self.widths[c] = max(self.widths.get(c, self.minwidth), len(str(value)) * 0.7)
+
+    def apply(self, ws):
+        for c, width in self.widths.items():
+            ws.column_dimensions[get_column_letter(c + 1)].width = width
+
+
+class XlsxStore:
+    """
+    Batch sheets of an xlsx workbook. The workbook is loaded as a whole and only written by save(), a readonly
+    store reads its sheets row by row.
+    """
+
+    def __init__(self, filename, readonly=False):
+        self.filename = filename
+        self.created = not os.path.exists(filename)
+        if self.created:
+            self.wb = Workbook()
+        elif readonly:
+            self.wb = util.load_workbook_cached(filename)
+        else:
+            logging.info("Opening %s" % filename)
+            self.wb = load_workbook(filename=filename)
+
+    def has_sheet(self, sheet):
+        return sheet in self.wb.get_sheet_names()
+
+    def get_sheet(self, sheet):
+        if self.has_sheet(sheet):
+            return self.wb.get_sheet_by_name(sheet)
+        if self.created and self.wb.get_sheet_names() == ["Sheet"]:
+            # the empty default sheet of a new workbook
+            ws = self.wb.active
+            ws.title = sheet
+            return ws
+        return self.wb.create_sheet(sheet)
+
+    def header(self, sheet):
+        if not self.has_sheet(sheet):
+            return []
+        for row in self.wb.get_sheet_by_name(sheet).rows:
+            return [cell.value for cell in row]
+        return []
+
+    def rows(self, sheet):
+        """
+        :return: iterator of (row number, list of values) of all rows below the header
+        """
+        assert self.has_sheet(sheet), "sheet %s does not exist in %s" % (sheet, self.filename)
+        for i, row in enumerate(self.wb.get_sheet_by_name(sheet).rows):
+            if i > 0:
+                yield i + 1, [cell.value for cell in row]
+
+    def write_sheet(self, sheet, header, rows):
+        """
+        Replaces the content of a sheet, cells beyond the new rows are cleared.
+        """
+        ws = self.get_sheet(sheet)
+        oldrows = ws.max_row
+        widths = ColumnWidths()
+        widths.update(header)
+        for c, value in enumerate(header):
+            ws.cell(row=1, column=c + 1).value = value
+        r = 1
+        for r, values in enumerate(rows, 2):
+            widths.update(values)
+            for c, value in enumerate(values):
+                ws.cell(row=r, column=c + 1).value = value
+        for i in range(r + 1, oldrows + 1):
+            for j in range(1, len(header) + 1):
+                ws.cell(row=i, column=j).value = None
+        widths.apply(ws)
+
+    def set_comment(self, sheet, column, text):
+        comment = comments.Comment(text, 'aligntool')
+        comment._width = '400pt'
+        self.get_sheet(sheet).cell(row=1, column=column).comment = comment
+
+    def save(self):
+        self.wb.save(self.filename)
+
+    def close(self):
+        pass
+
+
+def quote(name):
+    return '"%s"' % str(name).replace('"', '""')
+
+
+class SqliteStore:
+    """
+    Batch sheets as tables of an SQLite database, one column per sheet column plus the sheet row number, and
+    indexed by TextGrid. Every update is a transaction of its own. Sheets are replaced as a whole, only single row
+    updates (update_row) are meant to come from concurrent workers and processes, each with its own connection.
+    """
+
+    def __init__(self, filename, timeout=60):
+        self.filename = filename
+        # transactions are started explicitly, see transaction()
+        self.conn = sqlite3.connect(filename, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def has_sheet(self, sheet):
+        return self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (sheet,)).fetchone() \
+            is not None
+
+    def header(self, sheet):
+        return [x[1] for x in self.conn.execute("PRAGMA table_info(%s)" % quote(sheet)) if x[1] != ROW_COLUMN]
+
+    def rows(self, sheet):
+        """
+        :return: iterator of (row number, list of values) ordered by row number
+        """
+        assert self.has_sheet(sheet), "table %s does not exist in %s" % (sheet, self.filename)
+        columns = ", ".join(quote(x) for x in [ROW_COLUMN] + self.header(sheet))
+        for row in self.conn.execute("SELECT %s FROM %s ORDER BY %s" % (columns, quote(sheet), quote(ROW_COLUMN))):
+            yield row[0], list(row[1:])
+
+    def create_table(self, conn, sheet, header):
+        columns = ", ".join([quote(ROW_COLUMN) + " INTEGER PRIMARY KEY"] + [quote(x) for x in header])
+        conn.execute("CREATE TABLE %s (%s)" % (quote(sheet), columns))
+        if "TextGrid" in header:
+            conn.execute("CREATE INDEX %s ON %s (%s)" % (quote(sheet + "_textgrid"), quote(sheet), quote("TextGrid")))
+
+    def insert(self, conn, sheet, header, rows, first=None):
+        columns = ", ".join(quote(x) for x in [ROW_COLUMN] + header)
+        placeholders = ", ".join("?" * (len(header) + 1))
+        if first is None:
+            first = conn.execute("SELECT COALESCE(MAX(%s), 1) + 1 FROM %s" % (
+                quote(ROW_COLUMN), quote(sheet))).fetchone()[0]
+        conn.executemany("INSERT INTO %s (%s) VALUES (%s)" % (quote(sheet), columns, placeholders),
+                         ([r] + list(values[:len(header)]) + [None] * (len(header) - len(values))
+                          for r, values in enumerate(rows, first)))
+
+    def write_sheet(self, sheet, header, rows):
+        """
+        Replaces a table by the given rows, numbered from 2 like the rows of a sheet.
+        """
+        header = [x if x is not None else "Column%s" % (i + 1) for i, x in enumerate(header)]
+        with self.transaction() as conn:
+            conn.execute("DROP TABLE IF EXISTS %s" % quote(sheet))
+            self.create_table(conn, sheet, header)
+            self.insert(conn, sheet, header, rows, first=2)
+
+    def ensure_columns(self, sheet, columns):
+        """
+        Appends the columns missing in a table.
+        """
+        with self.transaction() as conn:
+            present = set(x[1] for x in conn.execute("PRAGMA table_info(%s)" % quote(sheet)))
+            for column in columns:
+                if column not in present:
+                    conn.execute("ALTER TABLE %s ADD COLUMN %s" % (quote(sheet), quote(column)))
+
+    def update_row(self, sheet, rownum, values):
+        """
+        :param values: dict column -> value
+        """
+        assignments = ", ".join("%s = ?" % quote(x) for x in values)
+        with self.transaction() as conn:
+            conn.execute("UPDATE %s SET %s WHERE %s = ?" % (quote(sheet), assignments, quote(ROW_COLUMN)),
+                         list(values.values()) + [rownum])
+
+    def replace_textgrids(self, sheet, header, replacements, order):
+        """
+        Replaces the rows of TextGrids in one transaction. Rows keep their place: the new rows of a TextGrid take the
+        row numbers of its old rows if there are as many, otherwise the table is renumbered once, with the rows
+        grouped by TextGrid in the given order.
+        :param replacements: list of (TextGrid, rows)
+        :param order: all TextGrids in the order of the sheet
+        """
+        with self.transaction() as conn:
+            if not self.has_sheet(sheet):
+                self.create_table(conn, sheet, header)
+            renumber = False
+            for textgrid, rows in replacements:
+                old = [x[0] for x in conn.execute("SELECT %s FROM %s WHERE %s = ? ORDER BY %s" % (
+                    quote(ROW_COLUMN), quote(sheet), quote("TextGrid"), quote(ROW_COLUMN)), (textgrid,))]
+                conn.execute("DELETE FROM %s WHERE %s = ?" % (quote(sheet), quote("TextGrid")), (textgrid,))
+                if old and len(old) == len(rows) and old[-1] - old[0] == len(old) - 1:
+                    self.insert(conn, sheet, header, rows, first=old[0])
+                else:
+                    self.insert(conn, sheet, header, rows)
+                    renumber = renumber or len(rows) > 0 or bool(old)
+            if renumber:
+                self.renumber(conn, sheet, order)
+
+    def renumber(self, conn, sheet, order):
+        """
+        Numbers the rows from 2 on, grouped by TextGrid in the given order, TextGrids not in it last.
+        """
+        conn.execute("CREATE TEMP TABLE aligntool_order (textgrid PRIMARY KEY, position INTEGER)")
+        conn.execute("CREATE TEMP TABLE aligntool_renumber (old INTEGER PRIMARY KEY, new INTEGER)")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO aligntool_order VALUES (?, ?)",
+                             ((x, i) for i, x in enumerate(order)))
+            conn.execute("INSERT INTO aligntool_renumber SELECT s.%(r)s, 1 + ROW_NUMBER() OVER (ORDER BY "
+                         "COALESCE(o.position, %(n)s), s.%(r)s) FROM %(t)s s LEFT JOIN aligntool_order o "
+                         "ON s.%(tg)s = o.textgrid" % dict(
+                             t=quote(sheet), r=quote(ROW_COLUMN), tg=quote("TextGrid"), n=len(order)))
+            # negative numbers first, the new numbers may collide with existing ones
+            conn.execute("UPDATE %(t)s SET %(r)s = -(SELECT new FROM aligntool_renumber WHERE old = %(t)s.%(r)s)"
+                         % dict(t=quote(sheet), r=quote(ROW_COLUMN)))
+            conn.execute("UPDATE %s SET %s = -%s" % (quote(sheet), quote(ROW_COLUMN), quote(ROW_COLUMN)))
+        finally:
+            conn.execute("DROP TABLE aligntool_order")
+            conn.execute("DROP TABLE aligntool_renumber")
+
+    def set_comment(self, sheet, column, text):
+        pass
+
+    def save(self):
+        # all updates are committed already
+        pass
+
+    def close(self):
+        self.conn.close()
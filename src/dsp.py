@@ -0,0 +1,270 @@
+import numpy as np
+
+
+# samples per block when streaming over a recording, about 22 seconds at 48kHz
+BLOCKSIZE = 2 ** 20
+
+
+def window_indices(nsamples, x1, dx, tmin, tmax):
+    """
+    Sample indices of many time windows at once. Windows are padded to the same width with their last index, padding
+    is marked in the returned mask.
+    :param x1: time of the first sample
+    :param dx: sampling period
+    :param tmin: array of window start times
+    :param tmax: array of window end times
+    :return: (indices, valid) 2d arrays with one row per window
+    """
+    lo, hi = window_bounds(nsamples, x1, dx, tmin, tmax)
+    width = int((hi - lo).max()) + 1 if len(lo) > 0 else 1
+    indices = lo[:, None] + np.arange(width)[None, :]
+    valid = indices <= hi[:, None]
+    # padding stays inside the window, a block holding the window holds all of its indices
+    return np.minimum(indices, hi[:, None]), valid
+
+
+def window_bounds(nsamples, x1, dx, tmin, tmax):
+    """
+    :return: (lo, hi) arrays of the first and last sample index of each window
+    """
+    lo = np.clip(np.ceil((np.asarray(tmin) - x1) / dx).astype(np.int64), 0, nsamples - 1)
+    hi = np.clip(np.floor((np.asarray(tmax) - x1) / dx).astype(np.int64), 0, nsamples - 1)
+    return lo, np.maximum(lo, hi)
+
+
+def time_of_maximum(signal, x1, dx, tmin, tmax, offset=0, nsamples=None):
+    """
+    Vectorized equivalent of praat's "Get time of maximum ... Parabolic" followed by
+    "Get value at time ... Nearest", for all windows [tmin, tmax] at once.
+    :param offset: index of signal[0] if signal is only a block of a longer signal with nsamples samples. The block
+                   has to contain the windows and one sample on either side of them.
+    :return: (times, values) of the maxima
+    """
+    nsamples = len(signal) + offset if nsamples is None else nsamples
+    indices, valid = window_indices(nsamples, x1, dx, tmin, tmax)
+    values = np.where(valid, signal[indices - offset], -np.inf)
+    imax = indices[np.arange(len(indices)), values.argmax(axis=1)]
+    # parabolic interpolation through the maximum and its neighbours
+    left = signal[np.maximum(imax - 1, 0) - offset]
+    centre = signal[imax - offset]
+    right = signal[np.minimum(imax + 1, nsamples - 1) - offset]
+    denom = left - 2 * centre + right
+    interior = (imax > 0) & (imax < nsamples - 1) & (denom < 0)
+    offset_frac = np.where(interior, 0.5 * (left - right) / np.where(denom == 0, 1, denom), 0.0)
+    times = x1 + (imax + offset_frac) * dx
+    nearest = np.clip(np.round((times - x1) / dx).astype(np.int64), 0, nsamples - 1)
+    return times, signal[nearest - offset]
+
+
+def seek_flanks(signal, x1, dx, times, halfwindow=0.01, relthreshold=0.5, offset=0, nsamples=None):
+    """
+    Vectorized onset refinement: within +-halfwindow around each time, find the first point where the absolute
+    (linearly interpolated) signal exceeds relthreshold times the absolute extremum of the window. Times without
+    such a point are returned unchanged.
+    :param offset: index of signal[0] if signal is only a block of a longer signal with nsamples samples
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return times
+    nsamples = len(signal) + offset if nsamples is None else nsamples
+    indices, valid = window_indices(nsamples, x1, dx, times - halfwindow, times + halfwindow)
+    extremum = np.where(valid, np.abs(signal[indices - offset]), 0).max(axis=1)
+    threshold = extremum * relthreshold
+    # walk from the window start in steps of one sampling period, like praat's seekflank loop did
+    steps = times[:, None] - halfwindow + np.arange(int(np.ceil(2 * halfwindow / dx)))[None, :] * dx
+    pos = np.clip((steps - x1) / dx, 0, nsamples - 1)
+    ilow = np.floor(pos).astype(np.int64)
+    ihigh = np.minimum(ilow + 1, nsamples - 1)
+    frac = pos - ilow
+    values = np.abs(signal[ilow - offset] * (1 - frac) + signal[ihigh - offset] * frac)
+    above = (values > threshold[:, None]) & (steps < (times + halfwindow)[:, None])
+    found = above.any(axis=1)
+    first = above.argmax(axis=1)
+    return np.where(found, steps[np.arange(len(times)), first], times)
+
+
+def seek_flanks_streaming(read, nsamples, x1, dx, times, halfwindow=0.01, relthreshold=0.5, blocksize=BLOCKSIZE):
+    """
+    seek_flanks on a signal that is read block by block with read(start, end), neighbouring times share a block.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    result = times.copy()
+    order = np.argsort(times, kind="stable")
+    first = 0
+    while first < len(order):
+        last = first + 1
+        while last < len(order) and (times[order[last]] - times[order[first]]) / dx < blocksize:
+            last += 1
+        group = order[first:last]
+        lo = max(int(np.floor((times[group[0]] - halfwindow - x1) / dx)) - 1, 0)
+        hi = min(int(np.ceil((times[group[-1]] + halfwindow - x1) / dx)) + 2, nsamples)
+        result[group] = seek_flanks(read(lo, hi), x1, dx, times[group], halfwindow, relthreshold,
+                                    offset=lo, nsamples=nsamples)
+        first = last
+    return result
+
+
+def read_padded(read, nsamples, start, end):
+    """
+    :return: samples start..end-1 of the signal, zero outside of 0..nsamples-1
+    """
+    block = np.zeros(end - start)
+    lo, hi = max(start, 0), min(end, nsamples)
+    if hi > lo:
+        block[lo - start:hi - start] = read(lo, hi)
+    return block
+
+
+def intensity(read, nsamples, samplerate, minpitch=100.0, timestep=0.01, subtractmean=False, blocksize=BLOCKSIZE):
+    """
+    Praat's "To Intensity" (Kaiser window of 6.4 / minpitch seconds, frames centred like Sampled_shortTermAnalysis)
+    for a signal that is read block by block with read(start, end). Frames do not depend on each other, the result
+    is the same as for the whole signal at once.
+    :return: (times, values) of the frames, values in dB
+    """
+    dx = 1.0 / samplerate
+    duration = nsamples * dx
+    windowduration = 6.4 / minpitch
+    halfwindow = 0.5 * windowduration
+    halfsamples = int(halfwindow / dx)
+    x = np.arange(-halfsamples, halfsamples + 1) * dx / halfwindow
+    root = 1 - x * x
+    window = np.where(root <= 0, 0.0, np.i0((2 * np.pi * np.pi + 0.5) * np.sqrt(np.maximum(root, 0))))
+    nframes = int(np.floor((duration - windowduration) / timestep)) + 1
+    if nframes < 1:
+        return np.zeros(0), np.zeros(0)
+    times = 0.5 * duration - 0.5 * nframes * timestep + 0.5 * timestep + np.arange(nframes) * timestep
+    mids = np.round((times - 0.5 * dx) / dx).astype(np.int64)
+    values = np.empty(nframes)
+    # frames per block, the windows of a block are materialized at once
+    framesperblock = max(1, min(blocksize // max(int(timestep * samplerate), 1), 2 ** 22 // len(window)))
+    width = len(window)
+    for f0 in range(0, nframes, framesperblock):
+        f1 = min(nframes, f0 + framesperblock)
+        start = mids[f0] - halfsamples
+        block = read_padded(read, nsamples, start, mids[f1 - 1] + halfsamples + 1)
+        rows = mids[f0:f1] - mids[f0]
+        amplitude = np.lib.stride_tricks.sliding_window_view(block, width)[rows]
+        # windows are cut off at the signal boundaries
+        indices = start + rows[:, None] + np.arange(width)[None, :]
+        valid = (indices >= 0) & (indices < nsamples)
+        sumw = valid @ window
+        if subtractmean:
+            mean = amplitude.sum(axis=1) / valid.sum(axis=1)
+            amplitude = (amplitude - mean[:, None]) * valid
+        energy = (amplitude * amplitude) @ window / sumw
+        values[f0:f1] = np.where(energy < 1e-30, -300.0, 10 * np.log10(np.maximum(energy, 1e-30) / 4.0e-10))
+    return times, values
+
+
+def resample(signal, from_rate, to_rate):
+    """
+    Band limited resampling in the frequency domain, meant for short signals like reference beeps.
+    """
+    if from_rate == to_rate:
+        return np.asarray(signal, dtype=np.float64)
+    n = int(round(len(signal) * float(to_rate) / from_rate))
+    spectrum = np.fft.rfft(signal)
+    resized = np.zeros(n // 2 + 1, dtype=complex)
+    keep = min(len(spectrum), len(resized))
+    resized[:keep] = spectrum[:keep]
+    return np.fft.irfft(resized, n) * (float(n) / len(signal))
+
+
+def fft_size(templatelength, minsize=65536):
+    return max(minsize, 1 << int(np.ceil(np.log2(8 * templatelength))))
+
+
+def template_spectrum(template, nfft):
+    return np.conj(np.fft.rfft(template, nfft))
+
+
+def cross_correlation_maxima(read, nsamples, template, spectrum, nfft, dx, tmin, tmax):
+    """
+    Cross-correlation of a signal with a short template by overlap-save blocks of size nfft, using the template's
+    precomputed conjugate spectrum, followed by time_of_maximum in the windows [tmin, tmax]. The signal is read
+    block by block with read(start, end) and only the parts of the correlation around pending windows are kept.
+    Values are scaled like praat's Cross-correlate with "peak 0.99" and zero padding, where the first correlation
+    value belongs to time -(len(template)-1) * dx.
+    :return: (times, values) of the maxima
+    """
+    m = len(template)
+    step = nfft - m + 1
+    nout = nsamples + m - 1
+    x1 = -(m - 1) * dx
+    tmin, tmax = np.asarray(tmin, dtype=np.float64), np.asarray(tmax, dtype=np.float64)
+    times, values = np.zeros(len(tmin)), np.zeros(len(tmin))
+    lo, hi = window_bounds(nout, x1, dx, tmin, tmax)
+    # windows are completed in order of their end, the correlation is kept from the earliest pending start on
+    order = np.argsort(hi, kind="stable")
+    keepfrom = np.minimum.accumulate(lo[order][::-1])[::-1] - 1
+    buf, bufstart, peak, done = np.zeros(0), 0, 0.0, 0
+    for start in range(0, nout, step):
+        block = read_padded(read, nsamples, start - (m - 1), start - (m - 1) + nfft)
+        corr = np.fft.irfft(np.fft.rfft(block, nfft) * spectrum, nfft)[:min(step, nout - start)]
+        peak = max(peak, float(np.abs(corr).max()))
+        buf = np.concatenate((buf, corr))
+        bufend = bufstart + len(buf)
+        ready = done
+        while ready < len(order) and (hi[order[ready]] + 1 < bufend or bufend == nout):
+            ready += 1
+        if ready > done:
+            sel = order[done:ready]
+            times[sel], values[sel] = time_of_maximum(buf, x1, dx, tmin[sel], tmax[sel],
+                                                      offset=bufstart, nsamples=nout)
+            done = ready
+        keep = min(max(keepfrom[done], bufstart), bufend) if done < len(order) else bufend
+        buf, bufstart = buf[keep - bufstart:], keep
+    if peak > 0:
+        values *= 0.99 / peak
+    return times, values
+
+
+def spectral_subtraction(read, nsamples, samplerate, noisestart, noiseend, windowlength=0.025, minfreq=80.0,
+                         maxfreq=8000.0, smoothing=40.0, blocksize=BLOCKSIZE):
+    """
+    Noise reduction like praat's "Remove noise ... Spectral subtraction": the mean magnitude spectrum of the noise
+    interval is subtracted from every frame of a Hann windowed STFT with 50% overlap, frequencies outside of
+    [minfreq, maxfreq] are removed with Hann shaped flanks of width smoothing. The signal is read block by block with
+    read(start, end).
+    :return: generator of consecutive blocks of the denoised signal
+    """
+    hop = max(int(round(windowlength * samplerate / 2)), 1)
+    length = 2 * hop
+    # periodic Hann windows at 50% overlap sum up to one, overlap-add needs no synthesis window
+    window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(length) / length)
+    freqs = np.fft.rfftfreq(length, 1.0 / samplerate)
+    band = np.clip(np.minimum(freqs - (minfreq - smoothing), (maxfreq + smoothing) - freqs) / max(smoothing, 1e-9),
+                   0, 1)
+    band = 0.5 - 0.5 * np.cos(np.pi * band)
+
+    # noise spectrum from the frames inside the noise interval
+    nstart = min(max(int(round(noisestart * samplerate)), 0), nsamples)
+    nend = min(max(int(round(noiseend * samplerate)), nstart + length), nsamples)
+    noise = read_padded(read, nsamples, nstart, max(nend, nstart + length))
+    nframes = max((len(noise) - length) // hop + 1, 1)
+    noiseframes = np.lib.stride_tricks.sliding_window_view(noise, length)[::hop][:nframes]
+    noisespectrum = np.abs(np.fft.rfft(noiseframes * window, axis=1)).mean(axis=0)
+
+    # frame k covers samples (k-1)*hop .. (k+1)*hop, every sample is covered by two frames
+    nframes = -(-nsamples // hop) + 1
+    framesperblock = max(blocksize // hop, 2)
+    tail = np.zeros(hop)
+    for k0 in range(0, nframes, framesperblock):
+        k1 = min(nframes, k0 + framesperblock)
+        start = (k0 - 1) * hop
+        block = read_padded(read, nsamples, start, (k1 - 1) * hop + length)
+        frames = np.lib.stride_tricks.sliding_window_view(block, length)[::hop][:k1 - k0] * window
+        spectra = np.fft.rfft(frames, axis=1)
+        magnitude = np.abs(spectra)
+        gain = band * np.maximum(magnitude - noisespectrum, 0) / np.where(magnitude > 0, magnitude, 1)
+        frames = np.fft.irfft(spectra * gain, length, axis=1)
+        out = np.zeros((k1 - k0 + 1) * hop)
+        out[:hop] = tail
+        for half in range(2):
+            out[half * hop:(k1 - k0 + half) * hop] += frames[:, half * hop:(half + 1) * hop].reshape(-1)
+        # the last half frame is completed by the next block
+        tail = out[-hop:]
+        first, last = max(start, 0), min(start + (k1 - k0) * hop, nsamples)
+        if last > first:
+            yield out[first - start:last - start]
@@ -0,0 +1,168 @@
+import http.client
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+
+# BAS web service, can be pointed to a local stand-in
+url = os.environ.get("ALIGNTOOL_G2P_URL", "https://clarin.phonetik.uni-muenchen.de/BASWebServices/services/runG2P")
+# limits of a single request
+chunkwords = 1000
+chunkbytes = 64 * 1024
+workers = 4
+retries = 3
+timeout = 300
+
+_connections = threading.local()
+
+
+class G2PException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def get_connection(scheme, netloc):
+    """
+    :return: a kept-alive connection to the host, one per thread
+    """
+    if not hasattr(_connections, "pool"):
+        _connections.pool = {}
+    key = (scheme, netloc)
+    if key not in _connections.pool:
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        _connections.pool[key] = cls(netloc, timeout=timeout)
+    return _connections.pool[key]
+
+
+def request(method, target, body=None, headers=None):
+    parts = urllib.parse.urlsplit(target)
+    conn = get_connection(parts.scheme, parts.netloc)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+    except (http.client.HTTPException, OSError):
+        # the server may have closed the kept-alive connection, the next attempt reconnects
+        conn.close()
+        raise
+    if response.status != 200:
+        raise G2PException("%s %s returned HTTP %s" % (method, target, response.status))
+    return data
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append(('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' %
+                      (boundary, name, value)).encode())
+    for name, (filename, content) in files.items():
+        lines.append(('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                      'Content-Type: text/plain\r\n\r\n' % (boundary, name, filename)).encode())
+        lines.append(content.encode("utf-8") + b"\r\n")
+    lines.append(("--%s--\r\n" % boundary).encode())
+    return b"".join(lines), "multipart/form-data; boundary=%s" % boundary
+
+
+def split_chunks(words):
+    chunk, size = [], 0
+    for w in words:
+        wsize = len(w.encode("utf-8")) + 1
+        if chunk and (len(chunk) >= chunkwords or size + wsize > chunkbytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(w)
+        size += wsize
+    if chunk:
+        yield chunk
+
+
+def run_g2p(words, language):
+    """
+    One request to the g2p service.
+    :return: list of (word, transcription) lines of the result
+    """
+    fields = dict(com="yes", align="no", stress="no", lng=language, syl="no", embed="no", iform="txt",
+                  tgrate="16000", nrm="no", oform="tab", map="no", featset="standard", tgitem="ort")
+    body, contenttype = encode_multipart(fields, {"i": ("lexicon.txt", "".join(w + "\n" for w in words))})
+    response = request("POST", url, body, {"Content-Type": contenttype})
+    try:
+        downloadlink = ElementTree.fromstring(response).findtext(".//downloadLink")
+    except ElementTree.ParseError:
+        downloadlink = None
+    if not downloadlink:
+        raise G2PException("g2p failed: %s" % response.decode("utf-8", "replace"))
+    result = request("GET", downloadlink).decode("utf-8")
+    return [tuple(line.split(";", 1)) for line in result.splitlines() if line]
+
+
+def map_result(words, lines):
+    """
+    Maps the result lines back to the requested words by their word column. Words the service rewrote (e.g.
+    expanded numbers) cannot be told apart in a chunk, only the line of a single requested word is unambiguous.
+    :return: dict word -> transcription without spaces, list of words without a matching line
+    """
+    lines = [line for line in lines if len(line) == 2]
+    byword = dict(reversed(lines))
+    if len(words) == 1 and words[0] not in byword and len(lines) == 1:
+        logging.warning("g2p expanded %s to %s" % (words[0], lines[0][0]))
+        byword[words[0]] = lines[0][1]
+    mapping, missing = {}, []
+    for w in words:
+        if w not in byword:
+            missing.append(w)
+        elif byword[w].strip() == "":
+            raise G2PException("word '%s' was mapped to empty string. Invalid chars?" % w)
+        else:
+            mapping[w] = "".join(byword[w].split(" "))
+    return mapping, missing
+
+
+def run_g2p_retrying(words, language):
+    for attempt in range(retries):
+        try:
+            return run_g2p(words, language)
+        except (G2PException, http.client.HTTPException, OSError) as e:
+            if attempt == retries - 1:
+                raise
+            logging.warning("g2p request for %s words failed (%s), retrying" % (len(words), e))
+            time.sleep(2 ** attempt)
+
+
+def transcribe_chunk(words, language):
+    """
+    Words not found in the result of their chunk are requested again one by one.
+    """
+    mapping, missing = map_result(words, run_g2p_retrying(words, language))
+    if len(words) > 1 and missing:
+        logging.info("Requesting %s words rewritten by g2p one by one" % len(missing))
+        for w in missing:
+            single, _ = map_result([w], run_g2p_retrying([w], language))
+            mapping.update(single)
+    unmatched = [w for w in words if w not in mapping]
+    if unmatched:
+        raise G2PException("g2p returned no transcription for %s" % ", ".join("'%s'" % w for w in unmatched))
+    return mapping
+
+
+def transcribe(words, language):
+    """
+    Phonetic transcriptions of words, requested in chunks of bounded size that are submitted concurrently.
+    :return: dict word -> transcription
+    """
+    chunks = list(split_chunks(sorted(set(words))))
+    logging.info("Requesting %s transcriptions in %s chunks from %s" % (
+        sum(len(x) for x in chunks), len(chunks), url))
+    pdict = {}
+    with ThreadPoolExecutor(max_workers=min(workers, max(len(chunks), 1))) as executor:
+        for mapping in executor.map(lambda chunk: transcribe_chunk(chunk, language), chunks):
+            pdict.update(mapping)
+    return pdict
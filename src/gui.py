@@ -76,19 +76,19 @@ class AlignToolGui(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def on_segment_beeps_btn(self):
         runner = xlsbatch.BatchRunner()
-        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd="segmentBeeps")
+        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd=["segmentBeeps"])
 
     def on_add_tier_btn(self):
         runner = xlsbatch.BatchRunner()
-        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd="addTier")
+        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd=["addTier"])
 
     def on_segment_speech_btn(self):
         runner = xlsbatch.BatchRunner()
-        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd="segmentSpeech")
+        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd=["segmentSpeech"])
 
     def on_align_maus_btn(self):
         runner = xlsbatch.BatchRunner()
-        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd="alignMAUS")
+        self.run_cmd(runner, xlsxfile=self.xlsxfile_edit.text(), batchcmd=["alignMAUS"])
 
     def on_extract_on_offsets_btn(self):
         runner = xlsbatch.OnOffsetExtractor()
@@ -1,11 +1,15 @@
+import functools
 import inspect
 import json
 import logging
+import os
 import shlex
 import subprocess
+import threading
+from collections import OrderedDict
 import openpyxl
 import tgt
-import wave
+import audio
 
 
 def get_wav_duration(filename):
@@ -13,10 +17,8 @@ def get_wav_duration(filename):
     :param filename: wavfile
     :return: length in seconds
     """
-    with wave.open(filename, 'r') as f:
-        samplerate = f.getframerate()
-        duration = f.getnframes() / float(samplerate)
-        return duration, samplerate
+    header = audio.probe(filename)
+    return header.nframes / float(header.samplerate), header.samplerate
 
 
 def tier_to_str(tier):
@@ -24,14 +26,14 @@ def tier_to_str(tier):
 
 
 def extract_optional_args(args):
-    names, varargs, varkw, defaults = inspect.getargspec(args.cmd)
-    keys = names[-len(defaults):]
+    spec = inspect.getfullargspec(args.cmd)
+    keys = spec.args[-len(spec.defaults):]
     d = vars(args)
     return dict((k, d[k]) for k in keys if k in d and d[k] is not None)
 
 
 def extract_args(args):
-    names, varargs, varkw, defaults = inspect.getargspec(args.cmd)
+    names = inspect.getfullargspec(args.cmd).args
     d = vars(args)
     return dict((k, d[k]) for k in names if k in d)
 
@@ -78,11 +80,46 @@ def call_check(cmd, return_stdout=False, stdindata=None, return_stderr=False):
     return output
 
 
+# TextGrids kept in memory between pipeline stages. Thread local, so that pipelines can run concurrently.
+_memory = threading.local()
+
+
+class MemoryTextGrids:
+    """
+    While active, read_textgrid and write_textgrid keep TextGrids in memory, keyed by filename, instead of going
+    through the file system.
+    """
+
+    def __enter__(self):
+        _memory.textgrids = {}
+        return _memory.textgrids
+
+    def __exit__(self, *exc_info):
+        _memory.textgrids = None
+
+
+def read_textgrid(filename):
+    textgrids = getattr(_memory, "textgrids", None)
+    if textgrids is not None and filename in textgrids:
+        return textgrids[filename]
+    logging.info("reading TextGrid %s" % filename)
+    return tgt.io.read_textgrid(filename)
+
+
+def write_textgrid(tg, filename, force=False):
+    textgrids = getattr(_memory, "textgrids", None)
+    if textgrids is not None:
+        textgrids[filename] = tg
+        if not force:
+            return
+    logging.info("Writing %s" % filename)
+    tgt.io.write_to_file(textgrid=tg, filename=filename, format="long")
+
+
 def init_textgrid(infile, duration, *tiers):
     tg = tgt.TextGrid()
     if infile is not None:
-        logging.info("reading TextGrid %s" % infile)
-        tg = tgt.io.read_textgrid(infile)
+        tg = read_textgrid(infile)
 
     result = [tg]
     for tier in tiers:
@@ -94,23 +131,67 @@ def init_textgrid(infile, duration, *tiers):
     return tuple(result)
 
 
+# workbooks are only kept by long running processes, set by aligntool serve
+cache_workbooks = False
+_workbooks = OrderedDict()
+_workbooks_lock = threading.Lock()
+
+
+def load_workbook_cached(filename, maxfiles=4):
+    """
+    Workbook opened for reading, cells are parsed while they are read. With cache_workbooks set it is kept while
+    the file is unchanged, so that a long running process (see aligntool serve) opens it only once. The workbook
+    is shared, callers must not modify it.
+    """
+    if not cache_workbooks:
+        return openpyxl.load_workbook(filename=filename, read_only=True)
+    path = os.path.realpath(filename)
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    with _workbooks_lock:
+        entry = _workbooks.pop(path, None)
+        if entry is None or entry[0] != key:
+            entry = (key, openpyxl.load_workbook(filename=path, read_only=True))
+        _workbooks[path] = entry
+        while len(_workbooks) > maxfiles:
+            _workbooks.popitem(last=False)
+        return entry[1]
+
+
 def get_sheet(infile, sheetname):
-    wb = openpyxl.load_workbook(filename=infile, read_only=True)
+    wb = load_workbook_cached(infile)
     sheet = wb[sheetname]
     cols = sheet.max_column
     headers = dict((sheet.cell(row=1, column=i).value, i - 1) for i in range(1, cols + 1))
     return sheet, headers
 
 
-def filter_data_row(values, prevvalues, datafilter):
-    evalvars = {"row": values, "prevrow": prevvalues}
+@functools.lru_cache(maxsize=64)
+def compile_filter(datafilter):
+    """
+    :param datafilter: python expression on the dicts row and prevrow, e.g. row["Duration"] > 60
+    :return: function (values, prevvalues) -> bool, the expression is compiled only once
+    """
     try:
-        ret = eval(datafilter, evalvars, evalvars)
-    except:
+        code = compile(datafilter, "<datafilter>", "eval")
+    except SyntaxError:
         logging.error("Exception parsing/evaluating datafilter (%s)" % datafilter)
         raise
-    assert ret in (True, False), "Filter function must return either true or false but not %s" % ret
-    return ret
+
+    def evaluate(values, prevvalues):
+        evalvars = {"row": values, "prevrow": prevvalues}
+        try:
+            ret = eval(code, evalvars, evalvars)
+        except:
+            logging.error("Exception parsing/evaluating datafilter (%s)" % datafilter)
+            raise
+        assert ret in (True, False), "Filter function must return either true or false but not %s" % ret
+        return ret
+    return evaluate
+
+
+def filter_data_row(values, prevvalues, datafilter):
+    return compile_filter(datafilter)(values, prevvalues)
 
 
 class MetaData:
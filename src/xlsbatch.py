@@ -1,14 +1,22 @@
 import fnmatch
+import functools
+import hashlib
+import itertools
+import json
 import os
 import shlex
+import struct
 import util
+import audio
 import logging
 import tgt
+import numpy as np
 import argparse
 
 import aligntool
-from openpyxl import Workbook, load_workbook, comments
-from collections import defaultdict, namedtuple
+import batchstore
+from collections import defaultdict, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 #todo: catch exceptions and print source column meta info
 #todo: reset onset cell range
@@ -16,6 +24,7 @@ from collections import defaultdict, namedtuple
 
 class ArgParseException(Exception):
     def __init__(self, message, helptext):
+        super().__init__(message, helptext)
         self.message = message
         self.helptext = helptext
 
@@ -32,16 +41,6 @@ class ArgParserWrapper(argparse.ArgumentParser):
         raise ArgParseException(message, self.format_help())
 
 
-def estimate_col_width(ws):
-    dims = {}
-    for row in ws.rows:
-        for cell in row:
-            if cell.value:
-                dims[cell.column] = max((dims.get(cell.column, 20), len(str(cell.value))*0.7))
-    for col, value in dims.items():
-        ws.column_dimensions[col].width = value
-
-
 class WavImporter:
 
     def __init__(self, sub_cmd_parser=None):
@@ -50,62 +49,325 @@ class WavImporter:
                                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
             cmd_parser.set_defaults(cmd=self.run)
             cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
-                                    required=True, help='xlsxfile')
+                                    required=True, help='xlsxfile, or sqlite batch store (.sqlite, .db)')
             cmd_parser.add_argument('-d', dest='directory', metavar='<d>', action='store', type=str,
                                     required=True, help='directory <d> to scan for wav files')
 
     def run(self, directory, xlsxfile):
-        if os.path.exists(xlsxfile):
-            wb = load_workbook(filename=xlsxfile)
-            if 'batch' in wb.get_sheet_names():
-                ws = wb.get_sheet_by_name('batch')
-            else:
-                ws = wb.create_sheet('batch')
-        else:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "batch"
-        i = 0
-        for head in ("Wavefile", "TextGrid"):
-            ws.cell(row=1, column=i+1).value = head
-            i += 1
-        for head in ("segmentBeeps", "addTier", "segmentSpeech", "alignMAUS", "extractOnOffsets"):
-            ws.cell(row=1, column=i + 1).value = head
-            try:
-                hcp = ArgParserWrapper()
-                if head == "extractOnOffsets":
-                    oe = OnOffsetExtractor()
-                    oe.get_option_parser().parse_args(shlex.split(head))
-                else:
-                    aligntool.parse_arguments(shlex.split(head), hcp)
-            except ArgParseException as e:
-                comment = comments.Comment(e.helptext, 'aligntool')
-                comment._width = '400pt'
-                ws.cell(row=1, column=i + 1).comment = comment
-            i += 1
-        row = 2
-        uniquetextgrids = set()
+        store = batchstore.open_store(xlsxfile)
+        # columns are looked up by name, columns added or moved by the user are kept and missing ones appended
+        header = store.header('batch')
+        header += [x for x in ["Wavefile", "TextGrid"] + list(COMMAND_COLUMNS) + list(HEADER_COLUMNS)
+                   if x not in header]
+        ncols = len(header)
+        wavcol, gridcol = header.index("Wavefile"), header.index("TextGrid")
         xlsxprefix, _ = os.path.splitext(xlsxfile)
         workdir = xlsxprefix + ".tg"
-        for root, dirs, files in os.walk(directory, topdown=True):
-            for f in fnmatch.filter(files, "*.[wW][aA][vV]"):
-                fname = os.path.join(root, f)
-                froot, ext = os.path.splitext(f)
-                fstr = ""
-                fnum = 0
-                while os.path.join(workdir, froot + fstr + ".TextGrid") in uniquetextgrids:
-                    fnum += 1
-                    fstr = str(fnum)
-                ws.cell(row=row, column=1).value = fname
-                gridfile = os.path.join(workdir, froot + fstr + ".TextGrid")
-                ws.cell(row=row, column=2).value = gridfile
-                uniquetextgrids.add(gridfile)
-                row += 1
-        for i in range(row, ws.max_row):
-            for j in range(1, 3):
-                ws.cell(row=i, column=j).value = None
-        estimate_col_width(ws)
-        wb.save(xlsxfile)
+        indexfile = xlsxprefix + ".scan.json"
+        headerfile = xlsxprefix + ".headers.json"
+        index = {}
+        if os.path.exists(indexfile):
+            with open(indexfile, 'r') as f:
+                index = json.load(f)
+        dirs = scan_wavs(directory, index)
+        wavfiles = sorted(os.path.join(d, name) for d, entry in dirs.items() for name in entry["wavs"])
+
+        # rows of files that still exist are kept with all their columns, new files are appended
+        wavset = set(wavfiles)
+        oldrows = []
+        if store.has_sheet('batch'):
+            oldrows = [(values + [None] * ncols)[:ncols] for _, values in store.rows('batch')]
+        keptrows = [x for x in oldrows if x[wavcol] in wavset]
+        known = set(x[wavcol] for x in keptrows)
+        used = set(x[gridcol] for x in keptrows)
+        counters = defaultdict(int)
+        newrows = []
+        for fname in wavfiles:
+            if fname in known:
+                continue
+            froot, _ = os.path.splitext(os.path.basename(fname))
+            # per name counter, the first free suffix is probed only once per file
+            fnum = counters[froot]
+            while True:
+                gridfile = os.path.join(workdir, froot + (str(fnum) if fnum else "") + ".TextGrid")
+                fnum += 1
+                if gridfile not in used:
+                    break
+            counters[froot] = fnum
+            used.add(gridfile)
+            row = [None] * ncols
+            row[wavcol], row[gridcol] = fname, gridfile
+            newrows.append(row)
+        logging.info("%s wav files: %s new, %s removed, %s of %s directories unchanged" % (
+            len(wavfiles), len(newrows), len(oldrows) - len(keptrows),
+            sum(1 for d in dirs if dirs[d] is index.get(d)), len(dirs)))
+
+        rows = keptrows + newrows
+        self.fill_headers(rows, wavcol, [header.index(x) for x in HEADER_COLUMNS], headerfile)
+        store.write_sheet('batch', header, rows)
+        add_command_help(store, header)
+        store.save()
+        with open(indexfile, 'w') as f:
+            json.dump(dirs, f)
+
+    @staticmethod
+    def fill_headers(rows, wavcol, columns, headerfile, workers=16):
+        """
+        Fills the header columns of all rows. Only the RIFF headers are read, concurrently, files unchanged since
+        the last run are taken from the header cache.
+        :param columns: indices of the HEADER_COLUMNS
+        """
+        audio.headers.load(headerfile)
+        with ThreadPoolExecutor(workers) as executor:
+            infos = list(executor.map(probe_wav, [row[wavcol] for row in rows]))
+        for row, info in zip(rows, infos):
+            for col, value in zip(columns, info):
+                row[col] = value
+        audio.headers.save(headerfile)
+
+
+# option columns of the batch sheet, one per command
+COMMAND_COLUMNS = ("segmentBeeps", "addTier", "segmentSpeech", "alignMAUS", "extractOnOffsets")
+
+
+def add_command_help(store, header):
+    """
+    Attaches the help text of each command as comment to its column header.
+    """
+    for head in COMMAND_COLUMNS:
+        try:
+            if head == "extractOnOffsets":
+                OnOffsetExtractor().get_option_parser().parse_args(shlex.split(head))
+            else:
+                aligntool.parse_arguments(shlex.split(head), aligntool.get_parser(ArgParserWrapper))
+        except ArgParseException as e:
+            store.set_comment('batch', header.index(head) + 1, e.helptext)
+
+
+# columns filled by wavlist from the wav headers
+HEADER_COLUMNS = ("Duration", "Samplerate", "Channels", "Bytes")
+
+
+def probe_wav(wavfile):
+    """
+    :return: values of the HEADER_COLUMNS for a wav file, empty if it cannot be read
+    """
+    if wavfile is None:
+        return (None,) * len(HEADER_COLUMNS)
+    try:
+        header = audio.probe(wavfile)
+        return (round(header.nframes / float(header.samplerate), 3), header.samplerate, header.nchannels,
+                os.path.getsize(wavfile))
+    except (OSError, AssertionError, struct.error) as e:
+        logging.warning("Unable to read wav header of %s: %s" % (wavfile, e))
+        return (None,) * len(HEADER_COLUMNS)
+
+
+def scan_directory(path, cached):
+    """
+    Lists the wav files and subdirectories of one directory. A directory with the same modification time as in
+    the scan index has the same entries, it is not listed again.
+    :return: (path, {"mtime": ..., "wavs": {name: [size, mtime]}, "subdirs": [...]})
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if cached is not None and cached["mtime"] == mtime:
+        return path, cached
+    wavs, subdirs = {}, []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                # like os.walk, symlinks to directories are not followed
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif fnmatch.fnmatch(entry.name, "*.[wW][aA][vV]"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    logging.warning("Ignoring unreadable %s" % entry.path)
+                    continue
+                wavs[entry.name] = [st.st_size, st.st_mtime_ns]
+    return path, {"mtime": mtime, "wavs": wavs, "subdirs": sorted(subdirs)}
+
+
+def scan_wavs(directory, index, workers=16):
+    """
+    Scans a directory tree for wav files, directories are listed concurrently.
+    :param index: result of a previous scan
+    :return: dict directory -> entry of scan_directory
+    """
+    dirs = {}
+    with ThreadPoolExecutor(workers) as executor:
+        pending = {executor.submit(scan_directory, directory, index.get(directory))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, entry = future.result()
+                dirs[path] = entry
+                for subdir in entry["subdirs"]:
+                    pending.add(executor.submit(scan_directory, subdir, index.get(subdir)))
+    return dirs
+
+
+# commands that mostly wait for the network or external binaries, all others are cpu bound
+IO_STAGES = ("alignMAUS",)
+
+
+# batch column with the outcome of the last command run on a row, kept in sqlite stores only
+STATUS_COLUMN = "Status"
+# sqlite stores for status updates, one connection per store and process
+status_stores = {}
+
+
+def record_status(storefile, rownum, status):
+    key = (storefile, os.getpid())
+    if key not in status_stores:
+        status_stores[key] = batchstore.SqliteStore(storefile)
+    status_stores[key].update_row('batch', rownum, {STATUS_COLUMN: status})
+
+
+def run_row_stages(infile, outfile, wavfile, stages, checkpoint, storefile=None, rownum=None):
+    """
+    :param storefile: sqlite batch store the row status is recorded in, by the worker running the row
+    """
+    try:
+        timings = aligntool.run_pipeline(infile, outfile, wavfile, stages, checkpoint, ArgParserWrapper)
+    except Exception as e:
+        if storefile is not None:
+            record_status(storefile, rownum, "%s failed: %s" % (" | ".join(x[0] for x in stages), e))
+        raise
+    if storefile is not None:
+        record_status(storefile, rownum, "%s done" % stages[-1][0])
+    return timings
+
+
+class CostModel:
+    """
+    Estimates the processing time of a row from the duration of its recording and the seconds per audio minute of
+    each command, learned from the timing log of previous runs.
+    """
+    # seconds per audio minute before anything was measured, only their ratios matter
+    DEFAULT_RATES = {"segmentBeeps": 2.0, "addTier": 0.1, "segmentSpeech": 1.0, "alignMAUS": 10.0}
+
+    def __init__(self, logfile, history=1000):
+        """
+        :param history: number of the latest records of each stage that are used and kept in the log, the log is
+        rewritten without the older ones when they make up half of it
+        """
+        self.logfile = logfile
+        self.history = history
+        self.rates = dict(self.DEFAULT_RATES)
+        self.measured = defaultdict(list)
+        self.lines = 0
+        if os.path.exists(logfile):
+            with open(logfile, 'r') as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.measured[record["stage"]].append((record["minutes"], record["seconds"]))
+                    self.lines += 1
+        for stage, records in self.measured.items():
+            del records[:-history]
+            minutes = sum(x[0] for x in records)
+            if minutes > 0:
+                self.rates[stage] = sum(x[1] for x in records) / minutes
+
+    def estimate(self, wavfile, stages):
+        minutes = util.get_wav_duration(wavfile)[0] / 60.0
+        return sum(minutes * self.rates.get(stage[0], 1.0) for stage in stages)
+
+    def record(self, wavfile, timings):
+        minutes = util.get_wav_duration(wavfile)[0] / 60.0
+        with open(self.logfile, 'a') as f:
+            for stage, seconds in timings:
+                print(json.dumps({"stage": stage, "minutes": minutes, "seconds": seconds}), file=f)
+                records = self.measured[stage]
+                records.append((minutes, seconds))
+                del records[:-self.history]
+                self.lines += 1
+        kept = sum(len(x) for x in self.measured.values())
+        if self.lines > 2 * kept:
+            self.compact()
+            self.lines = kept
+
+    def compact(self):
+        tmpfile = "%s.%s.tmp" % (self.logfile, os.getpid())
+        with open(tmpfile, 'w') as f:
+            for stage, records in self.measured.items():
+                for minutes, seconds in records:
+                    print(json.dumps({"stage": stage, "minutes": minutes, "seconds": seconds}), file=f)
+        os.replace(tmpfile, self.logfile)
+
+
+class BatchScheduler:
+    """
+    Runs the commands of all batch rows as tasks. A row's commands depend on each other and run in order, while
+    rows are independent. Consecutive cpu bound commands of a row form one task running in a process pool,
+    io bound commands run in a separate bounded thread pool, so e.g. the vad of one file runs while the next is
+    being aligned.
+    """
+
+    def __init__(self, jobs, iojobs, costmodel, storefile=None):
+        self.jobs = jobs
+        self.iojobs = iojobs
+        self.costmodel = costmodel
+        self.storefile = storefile
+
+    @staticmethod
+    def split_tasks(stages):
+        tasks = []
+        for stage in stages:
+            kind = "io" if stage[0] in IO_STAGES else "cpu"
+            if tasks and tasks[-1][0] == kind:
+                tasks[-1][1].append(stage)
+            else:
+                tasks.append((kind, [stage]))
+        return tasks
+
+    def run(self, rows, checkpoint):
+        """
+        :param rows: list of (rownum, infile, textgrid, wavfile, stages)
+        """
+        # longest processing time first, so that long recordings do not end up in the tail of the run
+        costs = dict((row[0], self.costmodel.estimate(row[3], row[4])) for row in rows)
+        rows = sorted(rows, key=lambda row: -costs[row[0]])
+        logging.info("Estimated processing time %.1f s, longest row %s with %.1f s" % (
+            sum(costs.values()), rows[0][0], costs[rows[0][0]]))
+        with ProcessPoolExecutor(self.jobs) as cpupool, ThreadPoolExecutor(self.iojobs) as iopool:
+            pools = {"cpu": cpupool, "io": iopool}
+            running = {}
+
+            def submit(rownum, infile, textgrid, wavfile, tasks):
+                kind, stages = tasks[0]
+                future = pools[kind].submit(run_row_stages, infile, textgrid, wavfile, stages, checkpoint,
+                                            self.storefile, rownum)
+                running[future] = (rownum, textgrid, wavfile, tasks[1:])
+
+            for rownum, infile, textgrid, wavfile, stages in rows:
+                submit(rownum, infile, textgrid, wavfile, self.split_tasks(stages))
+            failed = False
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rownum, textgrid, wavfile, tasks = running.pop(future)
+                    if future.cancelled():
+                        continue
+                    try:
+                        self.costmodel.record(wavfile, future.result())
+                    except Exception as e:
+                        logging.error("Batch processing failed in row %s: %s" % (rownum, str(e)))
+                        # like a sequential run, stop at the first failing row
+                        failed = True
+                        for pending in running:
+                            pending.cancel()
+                        continue
+                    if tasks and not failed:
+                        # later tasks of the row continue from the TextGrid written by the previous one
+                        submit(rownum, textgrid, textgrid, wavfile, tasks)
+
+
+@functools.lru_cache(maxsize=4096)
+def split_options(text):
+    # option cells mostly repeat across rows
+    return tuple(shlex.split(text))
 
 
 # Performs a batch run based on parameters in the files sheet
@@ -116,45 +378,93 @@ class BatchRunner:
                                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
             cmd_parser.set_defaults(cmd=self.run)
             cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
-                                    required=True, help='xlsxfile with batch sheet')
-            cmd_parser.add_argument('-c', dest='batchcmd', metavar='<cmd>', action='store', type=str,
-                                    required=True, help='command column to run')
-
-    def run(self, xlsxfile, batchcmd):
-        wb = load_workbook(filename=xlsxfile, read_only=True)
-        ws = wb['batch']
-        coldict = {}
-        try:
-            for i, row in enumerate(ws.rows):
-                if i == 0:
-                    coldict = {cell.value: i for i, cell in enumerate(row)}
-                    continue
-                wavfile = row[coldict['Wavefile']].value
-                textgrid = row[coldict['TextGrid']].value
-                if wavfile is None:
-                    logging.warning("Ignoring row %s: Wavefile column empty" % (i+1))
-                    continue
-                if textgrid is None:
-                    logging.warning("Ignoring row %s: TextGrid column empty" % (i+1))
-                    continue
-                cmdparams = row[coldict[batchcmd]].value
+                                    required=True, help='xlsxfile with batch sheet, or sqlite batch store')
+            cmd_parser.add_argument('-c', dest='batchcmd', metavar='<cmd>', action='append', type=str,
+                                    required=True, help='command column to run. If given several times, the '
+                                                        'commands are run as one in-memory pipeline per row')
+            cmd_parser.add_argument("--checkpoint", dest='checkpoint', action='store_true',
+                                    help='write the TextGrid after each command of a pipeline')
+            cmd_parser.add_argument('-j', "--jobs", dest='jobs', metavar='<n>', action='store', type=int, default=1,
+                                    help='process rows in parallel, running cpu bound commands in <n> processes')
+            cmd_parser.add_argument("--io-jobs", dest='iojobs', metavar='<n>', action='store', type=int, default=4,
+                                    help='number of concurrent network/external tool bound commands (alignMAUS) '
+                                         'when running with more than one job')
+            cmd_parser.add_argument("--where", dest='where', metavar='<expr>', action='store', type=str,
+                                    help='only process rows for which the python expression on the dicts row and '
+                                         'prevrow (the previous row) is true, e.g. "row[\'Duration\'] > 60"')
+
+    def get_rows(self, store, batchcmd, where=None):
+        coldict = {head: i for i, head in enumerate(store.header('batch'))}
+        for rownum, row in select_rows(store, 'batch', where):
+            wavfile = row[coldict['Wavefile']]
+            textgrid = row[coldict['TextGrid']]
+            if wavfile is None:
+                logging.warning("Ignoring row %s: Wavefile column empty" % rownum)
+                continue
+            if textgrid is None:
+                logging.warning("Ignoring row %s: TextGrid column empty" % rownum)
+                continue
+            stages = []
+            for cmd in batchcmd:
+                cmdparams = row[coldict[cmd]]
                 cmdparams = "" if cmdparams is None else cmdparams
-                logging.debug(wavfile, textgrid, cmdparams)
-                tgopts = []
+                stages.append([cmd] + list(split_options(cmdparams)))
+            yield rownum, wavfile, textgrid, stages
+
+    @staticmethod
+    def validate(rows):
+        """
+        Checks wav files and command options of all rows before any work starts.
+        :return: True if all rows are valid
+        """
+        invalid = 0
+        for rownum, infile, textgrid, wavfile, stages in rows:
+            try:
+                stageargs = aligntool.parse_pipeline(infile, textgrid, wavfile, stages, ArgParserWrapper)
+                aligntool.check_channels(stageargs, wavfile)
+            except (ArgParseException, AssertionError, ValueError, OSError, struct.error) as e:
+                logging.error("Row %s: %s" % (rownum, str(e)))
+                invalid += 1
+        if invalid > 0:
+            logging.error("Batch validation failed: %s of %s rows are invalid" % (invalid, len(rows)))
+        return invalid == 0
+
+    def run(self, xlsxfile, batchcmd, checkpoint=False, jobs=1, iojobs=4, where=None):
+        xlsxprefix, _ = os.path.splitext(xlsxfile)
+        audio.headers.load(xlsxprefix + ".headers.json")
+        costmodel = CostModel(xlsxprefix + ".timings.jsonl")
+        store = batchstore.open_store(xlsxfile, readonly=True)
+        rownum = 1
+        try:
+            rows = []
+            for rownum, wavfile, textgrid, stages in self.get_rows(store, batchcmd, where):
+                logging.debug(wavfile, textgrid, stages)
+                infile = None
                 if os.path.exists(textgrid):
-                    tgopts = ['-i', textgrid]
+                    infile = textgrid
                 else:
                     path = os.path.dirname(textgrid)
                     os.makedirs(name=path, exist_ok=True)
-                cmd = [batchcmd] + tgopts + ['-o', textgrid, '-w', wavfile] + shlex.split(cmdparams)
-                logging.info("Row %s: running: %s" % (i+1, " ".join(cmd)))
-                apw = ArgParserWrapper("")
-                args = aligntool.parse_arguments(cmd, apw)
-                args.cmd(**util.extract_args(args))
+                rows.append((rownum, infile, textgrid, wavfile, stages))
+            if not self.validate(rows):
+                return
+            storefile = None
+            if batchstore.is_sqlite(xlsxfile):
+                # workers record the outcome of each row as it finishes
+                store.ensure_columns('batch', [STATUS_COLUMN])
+                storefile = xlsxfile
+            if jobs > 1:
+                logging.info("Scheduling %s rows on %s processes and %s io workers" % (len(rows), jobs, iojobs))
+                BatchScheduler(jobs, iojobs, costmodel, storefile).run(rows, checkpoint)
+            else:
+                for rownum, infile, textgrid, wavfile, stages in rows:
+                    logging.info("Row %s: running: %s" % (rownum, " | ".join(" ".join(x) for x in stages)))
+                    costmodel.record(wavfile, run_row_stages(infile, textgrid, wavfile, stages, checkpoint,
+                                                             storefile, rownum))
         except ArgParseException as e:
-            logging.error("Batch processing failed in row %s:%s" % (i+1, str(e)))
+            logging.error("Batch processing failed in row %s:%s" % (rownum, str(e)))
         except Exception as e:
-            logging.error("Batch processing failed in row %s: %s" % (i+1, str(e)))
+            logging.error("Batch processing failed in row %s: %s" % (rownum, str(e)))
 
 
 # Imports generated Textgrids, e.g. after each command run
@@ -166,47 +476,192 @@ class TextGridBulkImporter:
                                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
             cmd_parser.set_defaults(cmd=self.run)
             cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
-                                    required=True, help='xlsxfile with batch sheet')
-
-    def run(self, xlsxfile):
-        logging.info("Opening %s" % xlsxfile)
-        wb = load_workbook(filename=xlsxfile)
-        ws = wb['batch']
-        if 'segments' in wb.get_sheet_names():
-            segws = wb.get_sheet_by_name('segments')
-        else:
-            segws = wb.create_sheet('segments')
-
-        header = ["TextGrid", "TierName", "StartTime", "EndTime", "Text"]
-        for i, head in enumerate(header):
-            segws.cell(row=1, column=i+1).value = head
-
-        coldict = {}
-        rowcnt = 1
-        for i, row in enumerate(ws.rows):
-            if i == 0:
-                coldict = {cell.value: i for i, cell in enumerate(row)}
-                continue
-            rowcnt += 1
-            textgridfilename = row[coldict['TextGrid']].value
-            if textgridfilename is None:
-                continue
-            logging.info("Reading %s" % textgridfilename)
-            tg = tgt.io.read_textgrid(textgridfilename)
-            rowvalues = [textgridfilename, "<range>", float(tg.start_time), float(tg.end_time), ""]
-            for j, val in enumerate(rowvalues):
-                segws.cell(row=rowcnt, column=j + 1).value = val
-            for tier in tg:
-                for iv in tier:
-                    rowcnt += 1
-                    rowvalues = [textgridfilename, tier.name, float(iv.start_time), float(iv.end_time), iv.text]
-                    for j, val in enumerate(rowvalues):
-                        segws.cell(row=rowcnt, column=j+1).value = val
-        for i in range(rowcnt+1, segws.max_row+1):
-            for j in range(1, len(header)+1):
-                segws.cell(row=i, column=j).value = None
-        estimate_col_width(segws)
-        wb.save(xlsxfile)
+                                    required=True, help='xlsxfile with batch sheet, or sqlite batch store. An '
+                                                        'xlsxfile is loaded and saved as a whole on every import, '
+                                                        'only a sqlite store is updated incrementally')
+            cmd_parser.add_argument('-j', "--jobs", dest='jobs', metavar='<n>', action='store', type=int,
+                                    default=os.cpu_count() or 1, help='number of processes reading TextGrids')
+            cmd_parser.add_argument("--where", dest='where', metavar='<expr>', action='store', type=str,
+                                    help='only process rows for which the python expression on the dicts row and '
+                                         'prevrow (the previous row) is true, e.g. "row[\'Duration\'] > 60"')
+
+    def run(self, xlsxfile, jobs=1, where=None):
+        """
+        Only TextGrids changed since the last import, or whose rows were edited in the segments sheet, are read
+        again. Their file state and the digest of their rows are kept in <xlsxfile prefix>.segments.json. Rows of
+        TextGrids not selected by the filter are kept as they are. Columns added after the segment columns keep
+        their values for segments with the same tier and start time.
+        A sqlite store only rewrites the rows of changed TextGrids, an xlsx workbook is still loaded and saved as a
+        whole if anything changed.
+        """
+        store = batchstore.open_store(xlsxfile)
+        xlsxprefix, _ = os.path.splitext(xlsxfile)
+        indexfile = xlsxprefix + ".segments.json"
+        index = load_segment_index(indexfile)
+        coldict = {head: i for i, head in enumerate(store.header('batch'))}
+        textgrids = []
+        for _, row in store.rows('batch'):
+            textgrids.append(row[coldict['TextGrid']])
+        textgrids = list(OrderedDict.fromkeys(x for x in textgrids if x is not None))
+        selected = textgrids
+        if where is not None:
+            selected = [row[coldict['TextGrid']] for _, row in select_rows(store, 'batch', where)]
+            selected = list(OrderedDict.fromkeys(x for x in selected if x is not None))
+        current = defaultdict(list)
+        valid = store.has_sheet('segments') and store.header('segments')[:len(SEGMENT_HEADER)] == SEGMENT_HEADER
+        header = store.header('segments') if valid else SEGMENT_HEADER
+        if valid:
+            for _, row in store.rows('segments'):
+                current[row[0]].append((list(row) + [None] * len(header))[:len(header)])
+
+        changed = [x for x in selected if not self.is_current(x, index.get(x), current.get(x))]
+        logging.info("%s of %s TextGrids changed since the last import" % (len(changed), len(selected)))
+        results = list(map_jobs(import_textgrid, [(x,) for x in changed], jobs))
+        for textgridfilename, (key, sha1, segrows) in zip(changed, results):
+            index[textgridfilename] = {"key": key, "sha1": sha1, "digest": segments_digest(segrows)}
+            current[textgridfilename] = keep_extra_columns(segrows, current.get(textgridfilename, []), len(header))
+        removed = set(current) - set(textgrids)
+
+        if isinstance(store, batchstore.SqliteStore) and valid:
+            # rows of other TextGrids stay untouched
+            store.replace_textgrids('segments', header,
+                                    [(x, current[x]) for x in changed] + [(x, []) for x in removed], textgrids)
+        elif changed or removed or not valid:
+            store.write_sheet('segments', header, [x for tg in textgrids for x in current[tg]])
+            store.save()
+        save_segment_index(indexfile, dict((x, index[x]) for x in textgrids if x in index))
+
+    @staticmethod
+    def is_current(textgridfilename, entry, segrows):
+        """
+        :return: True if the rows of the TextGrid are unchanged since the last import and the file has the same
+        content. Files are only hashed if their size or modification time changed.
+        """
+        if entry is None or segrows is None or segments_digest(segrows) != entry["digest"]:
+            return False
+        try:
+            key = file_key(textgridfilename)
+        except OSError:
+            return False
+        if key == entry["key"]:
+            return True
+        if file_sha1(textgridfilename) == entry["sha1"]:
+            entry["key"] = key
+            return True
+        return False
+
+
+def select_rows(store, sheet, where):
+    """
+    :param where: filter expression, see util.compile_filter, or None for all rows
+    :return: iterator of (row number, list of values) of the matching rows
+    """
+    if where is None:
+        yield from store.rows(sheet)
+        return
+    header = store.header(sheet)
+    matches = util.compile_filter(where)
+    prevrow = None
+    selected = 0
+    for rownum, values in store.rows(sheet):
+        row = dict(zip(header, values))
+        if matches(row, prevrow):
+            selected += 1
+            yield rownum, values
+        prevrow = row
+    logging.info("%s rows of sheet %s selected by %s" % (selected, sheet, where))
+
+
+def map_jobs(func, args, jobs):
+    """
+    Calls func for each tuple of arguments, in a process pool if there are several jobs.
+    :return: iterator of the results in the order of args
+    """
+    if jobs > 1 and len(args) > 1:
+        with ProcessPoolExecutor(min(jobs, len(args))) as executor:
+            yield from executor.map(func, *zip(*args), chunksize=max(1, len(args) // (4 * jobs)))
+    else:
+        for x in args:
+            yield func(*x)
+
+
+SEGMENT_HEADER = ["TextGrid", "TierName", "StartTime", "EndTime", "Text"]
+
+
+def load_segment_index(indexfile):
+    """
+    :return: dict TextGrid -> {"key": [size, mtime], "sha1": ..., "digest": digest of its segment rows}
+    """
+    if not os.path.exists(indexfile):
+        return {}
+    with open(indexfile, 'r') as f:
+        return json.load(f)
+
+
+def save_segment_index(indexfile, index):
+    tmpfile = "%s.%s.tmp" % (indexfile, os.getpid())
+    with open(tmpfile, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmpfile, indexfile)
+
+
+def file_key(filename):
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def file_sha1(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def normalize_cell(value):
+    """
+    String of a cell value that is stable across the round trip through a sheet.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # the workbook keeps fewer digits than repr()
+        return "%.12g" % value
+    return str(value)
+
+
+def segments_digest(segrows):
+    """
+    Digest of the segment columns of the rows of one TextGrid, columns added by the user are not part of it.
+    """
+    values = [[normalize_cell(x) for x in row[:len(SEGMENT_HEADER)]] for row in segrows]
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def keep_extra_columns(segrows, oldrows, width):
+    """
+    Extends freshly imported segment rows to width columns, with the values of the columns after the segment
+    columns taken from the old row of the same tier and start time.
+    """
+    extra = width - len(SEGMENT_HEADER)
+    if extra <= 0:
+        return segrows
+    olddict = {}
+    for row in oldrows:
+        olddict.setdefault((row[1], normalize_cell(row[2])), row[len(SEGMENT_HEADER):])
+    return [row + olddict.get((row[1], normalize_cell(row[2])), [None] * extra) for row in segrows]
+
+
+def import_textgrid(textgridfilename):
+    """
+    :return: ([size, mtime], sha1, segment rows) of a TextGrid
+    """
+    logging.info("Reading %s" % textgridfilename)
+    key = file_key(textgridfilename)
+    sha1 = file_sha1(textgridfilename)
+    tg = tgt.io.read_textgrid(textgridfilename)
+    segrows = [[textgridfilename, "<range>", float(tg.start_time), float(tg.end_time), ""]]
+    for tier in tg:
+        for iv in tier:
+            segrows.append([textgridfilename, tier.name, float(iv.start_time), float(iv.end_time), iv.text])
+    return key, sha1, segrows
 
 
 # Generates Textgrids, e.g. after xls edits
@@ -217,9 +672,12 @@ class TextGridBulkExporter:
                                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
             cmd_parser.set_defaults(cmd=self.run)
             cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
-                                    required=True, help='xlsxfile with segments sheet')
+                                    required=True, help='xlsxfile with segments sheet, or sqlite batch store')
+            cmd_parser.add_argument('-j', "--jobs", dest='jobs', metavar='<n>', action='store', type=int,
+                                    default=os.cpu_count() or 1, help='number of processes writing TextGrids')
 
-    def set_range(self, tg):
+    @staticmethod
+    def set_range(tg):
         if hasattr(tg, 'range_start_time'):
             tiers = tg.get_tier_names()
             if len(tiers) > 0:
@@ -227,54 +685,83 @@ class TextGridBulkExporter:
                 tier.start_time = tg.range_start_time
                 tier.end_time = tg.range_end_time
 
-    def run(self, xlsxfile):
-        logging.info("Opening %s" % xlsxfile)
-        wb = load_workbook(filename=xlsxfile)
-        assert 'segments' in wb.get_sheet_names(), "sheet segments, required for export, does not exist in %s" % xlsxfile
-        segws = wb.get_sheet_by_name('segments')
-        tgdict = defaultdict(tgt.TextGrid)
-        for seg_row_num, seg_row in enumerate(segws.rows):
-            if seg_row_num == 0:
-                segcoldict = {cell.value: i for i, cell in enumerate(seg_row)}
-                continue
-            textgrid = seg_row[segcoldict['TextGrid']].value
-            tiername = seg_row[segcoldict['TierName']].value
-            tbegin = seg_row[segcoldict['StartTime']].value
-            tend = seg_row[segcoldict['EndTime']].value
-            text = seg_row[segcoldict['Text']].value
-            if None in (textgrid, tiername, tbegin, tend):
-                continue
-            tg = tgdict[textgrid]
-            if tiername == "<range>":
-                tg.range_end_time = tend
-                tg.range_start_time = tbegin
-                self.set_range(tg)
+    def run(self, xlsxfile, jobs=1):
+        """
+        Only TextGrids whose rows differ from the last import or export are written, see TextGridBulkImporter.
+        """
+        store = batchstore.open_store(xlsxfile, readonly=True)
+        assert store.has_sheet('segments'), "sheet segments, required for export, does not exist in %s" % xlsxfile
+        xlsxprefix, _ = os.path.splitext(xlsxfile)
+        indexfile = xlsxprefix + ".segments.json"
+        index = load_segment_index(indexfile)
+        segcoldict = {head: i for i, head in enumerate(store.header('segments'))}
+        columns = [segcoldict[x] for x in SEGMENT_HEADER]
+        segments = OrderedDict()
+        for _, seg_row in store.rows('segments'):
+            segrow = [seg_row[i] for i in columns]
+            if segrow[0] is not None:
+                segments.setdefault(segrow[0], []).append(segrow)
+        changed = []
+        for filename, segrows in segments.items():
+            if not any(None not in x[:4] for x in segrows):
                 continue
-            if not text:
+            digest = segments_digest(segrows)
+            entry = index.get(filename)
+            if entry is not None and entry["digest"] == digest and os.path.exists(filename):
                 continue
-            if not tg.has_tier(tiername):
-                tier = tgt.IntervalTier(name=tiername)
-                tg.add_tier(tier)
-            else:
-                tier = tg.get_tier_by_name(tiername)
-            iv = tgt.Annotation(tbegin, tend, text)
-            tier.add_annotation(iv)
-            self.set_range(tg)
-        for filename, tg in tgdict.items():
-            logging.info("Writing %s" % filename)
-            path = os.path.dirname(filename)
-            os.makedirs(name=path, exist_ok=True)
-            tgt.io.write_to_file(tg, filename)
+            changed.append(filename)
+            # the file is read again by the next import, its rows are already up to date
+            index[filename] = {"key": None, "sha1": None, "digest": digest}
+        logging.info("%s of %s TextGrids changed since the last import or export" % (len(changed), len(segments)))
+        for _ in map_jobs(export_textgrid, [(x, segments[x]) for x in changed], jobs):
+            pass
+        save_segment_index(indexfile, index)
+
+
+def export_textgrid(filename, segrows):
+    """
+    Writes a TextGrid from its rows of the segments sheet, replacing the file atomically.
+    """
+    tg = tgt.TextGrid()
+    for textgrid, tiername, tbegin, tend, text in segrows:
+        if None in (textgrid, tiername, tbegin, tend):
+            continue
+        if tiername == "<range>":
+            tg.range_end_time = tend
+            tg.range_start_time = tbegin
+            TextGridBulkExporter.set_range(tg)
+            continue
+        if not text:
+            continue
+        if not tg.has_tier(tiername):
+            tier = tgt.IntervalTier(name=tiername)
+            tg.add_tier(tier)
+        else:
+            tier = tg.get_tier_by_name(tiername)
+        iv = tgt.Annotation(tbegin, tend, text)
+        tier.add_annotation(iv)
+        TextGridBulkExporter.set_range(tg)
+    logging.info("Writing %s" % filename)
+    path = os.path.dirname(filename)
+    os.makedirs(name=path, exist_ok=True)
+    tmpfile = "%s.%s.tmp" % (filename, os.getpid())
+    tgt.io.write_to_file(tg, tmpfile)
+    os.replace(tmpfile, filename)
+
+
+ON_OFFSET_HEADER = ("TextGrid", "Error", "ErrorMsg", "Transcription", "AlignOnset", "AlignOffset", "WordCount",
+                    "NumWords", "OnsetPhoneme", "OffsetPhoneme", "PresegBegin")
+OnOffsetColumns = namedtuple("OnOffsetColumns", ON_OFFSET_HEADER)
+ON_OFFSET_COLUMNS = OnOffsetColumns(*range(len(ON_OFFSET_HEADER)))
+# phone labels that are not part of a word's on/offset
+PHONE_MARKERS = ("?", "<p:>", "<usb>")
 
 
 class OnOffsetExtractor:
 
     def __init__(self, sub_cmd_parser=None):
-        self.rowpos = 1
-        self.header = ("TextGrid", "Error", "ErrorMsg", "Transcription", "AlignOnset", "AlignOffset", "WordCount",
-                       "NumWords", "OnsetPhoneme", "OffsetPhoneme", "PresegBegin")
-        self.ColHead = namedtuple("ColHead", self.header)
-        self.colids = self.ColHead(*range(1, len(self.header) + 1))
+        self.header = ON_OFFSET_HEADER
+        self.colids = ON_OFFSET_COLUMNS
         if sub_cmd_parser:
             cmd_parser = sub_cmd_parser.add_parser('extractOnOffsets', help='find onsets and offsets within a filter '
                                                                             'interval and save it to a OnsetOffset '
@@ -282,7 +769,15 @@ class OnOffsetExtractor:
                                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
             cmd_parser.set_defaults(cmd=self.run)
             cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
-                                    required=True, help='xlsxfile with batch sheet')
+                                    required=True, help='xlsxfile with batch sheet, or sqlite batch store')
+            cmd_parser.add_argument('-o', dest='output', metavar='<file>', action='store', type=str,
+                                    help='write the on_offsets sheet to a separate .xlsx or .csv file instead of '
+                                         'the batch workbook, which then stays unchanged')
+            cmd_parser.add_argument('-j', "--jobs", dest='jobs', metavar='<n>', action='store', type=int,
+                                    default=os.cpu_count() or 1, help='number of processes reading TextGrids')
+            cmd_parser.add_argument("--where", dest='where', metavar='<expr>', action='store', type=str,
+                                    help='only process rows for which the python expression on the dicts row and '
+                                         'prevrow (the previous row) is true, e.g. "row[\'Duration\'] > 60"')
 
     def get_option_parser(self):
         cmd_parser = ArgParserWrapper("extractOnOffsets")
@@ -292,84 +787,180 @@ class OnOffsetExtractor:
                                 help='pre-segmentation tier')
         return cmd_parser
 
-    def run(self, xlsxfile):
-        logging.info("Opening %s" % xlsxfile)
-        wb = load_workbook(filename=xlsxfile)
-        ws = wb['batch']
-        if 'on_offsets' in wb.get_sheet_names():
-            statws = wb.get_sheet_by_name('on_offsets')
-        else:
-            statws = wb.create_sheet('on_offsets')
-        for i, head in enumerate(self.header):
-            statws.cell(row=1, column=i + 1).value = head
+    def run(self, xlsxfile, output=None, jobs=1, where=None):
+        """
+        With a filter, the rows of the selected TextGrids replace their previous rows in the on_offsets sheet.
+        """
+        store = batchstore.open_store(xlsxfile, readonly=output is not None)
         optionparser = self.get_option_parser()
-        coldict = {}
+        coldict = {head: i for i, head in enumerate(store.header('batch'))}
+        tasks = []
+        order = list(OrderedDict.fromkeys(row[coldict['TextGrid']] for _, row in store.rows('batch')))
+        rownum = 1
         try:
-            for i, row in enumerate(ws.rows):
-                if i == 0:
-                    coldict = {cell.value: i for i, cell in enumerate(row)}
-                    continue
-                textgridfilename = row[coldict['TextGrid']].value
+            for rownum, row in select_rows(store, 'batch', where):
+                textgridfilename = row[coldict['TextGrid']]
                 if textgridfilename is None:
                     continue
-                cmdparams = row[coldict['extractOnOffsets']].value
+                cmdparams = row[coldict['extractOnOffsets']]
                 if cmdparams is None:
                     cmdparams = ""
                 options = optionparser.parse_args(shlex.split(cmdparams))
-                self.on_offsets_from_tg(textgridfilename, options.filtertiername, statws)
-            for i in range(self.rowpos+1, statws.max_row+1):
-                for j in range(1, len(self.header)+1):
-                    statws.cell(row=i, column=j).value = None
-            wb.save(xlsxfile)
+                tasks.append((textgridfilename, options.filtertiername))
         except Exception as e:
-            logging.error("Batch processing failed in row %s: %s" % (i+1, str(e)))
+            logging.error("Batch processing failed in row %s: %s" % (rownum, str(e)))
             raise
+        # rows are written while later TextGrids are still being processed
+        results = map_jobs(on_offsets_from_tg, tasks, jobs)
+        records = (record for records in results for record in records)
+        if output is not None:
+            batchstore.write_table(output, 'on_offsets', self.header, records)
+        elif where is None or not store.has_sheet('on_offsets'):
+            store.write_sheet('on_offsets', self.header, records)
+            store.save()
+        elif isinstance(store, batchstore.SqliteStore):
+            store.replace_textgrids('on_offsets', list(self.header),
+                                    [(x[0], tgrecords) for x, tgrecords in zip(tasks, results)], order)
+        else:
+            # rows stay grouped in the order of the batch sheet
+            position = dict((x, i) for i, x in enumerate(order))
+            selected = set(x[0] for x in tasks)
+            kept = [values for _, values in store.rows('on_offsets') if values[0] not in selected]
+            store.write_sheet('on_offsets', self.header, sorted(itertools.chain(kept, records),
+                                                                key=lambda x: position.get(x[0], len(order))))
+            store.save()
+
+    def on_offsets_from_tg(self, textgridfilename, filtertiername):
+        return on_offsets_from_tg(textgridfilename, filtertiername)
+
+
+def overlap_ranges(intervals, qstarts, qends):
+    """
+    Index ranges of the intervals overlapping each query interval, for all queries at once the same as
+    tier.get_annotations_between_timepoints(start, end, left_overlap=True, right_overlap=True).
+    :return: arrays lo, hi
+    """
+    starts = np.array([float(x.start_time) for x in intervals])
+    ends = np.array([float(x.end_time) for x in intervals])
+    precision = tgt.Time._precision
+    lo = np.searchsorted(ends, np.array(qstarts, dtype=float) + precision, side='left')
+    hi = np.searchsorted(starts, np.array(qends, dtype=float) - precision, side='right')
+    # rounding can move a bound by one at the precision limit, the fuzzy comparisons of tgt.Time decide
+    n = len(intervals)
+    for k, (qstart, qend) in enumerate(zip(qstarts, qends)):
+        qstart, qend = tgt.Time(qstart), tgt.Time(qend)
+        while lo[k] > 0 and qstart < ends[lo[k] - 1]:
+            lo[k] -= 1
+        while lo[k] < n and not qstart < ends[lo[k]]:
+            lo[k] += 1
+        while hi[k] > 0 and not tgt.Time(starts[hi[k] - 1]) < qend:
+            hi[k] -= 1
+        while hi[k] < n and tgt.Time(starts[hi[k]]) < qend:
+            hi[k] += 1
+    return lo, np.maximum(hi, lo)
+
+
+def on_offsets_from_tg(textgridfilename, filtertiername):
+    """
+    Rows of the on_offsets sheet for one TextGrid, one per aligned word within the speech intervals of the filter
+    tier. Words are joined to the segments and phones to the words by sorted index ranges instead of a range query
+    per interval. A TextGrid that cannot be processed gets an error row.
+    """
+    logging.info("Reading %s" % textgridfilename)
+    ids = ON_OFFSET_COLUMNS
+    records = []
+    try:
+        tg = tgt.io.read_textgrid(textgridfilename)
+        words = list(tg.get_tier_by_name("maus.ort"))
+        phones = list(tg.get_tier_by_name("maus.pho"))
+        segs = [s for s in tg.get_tier_by_name(filtertiername) if s.text == "speech"]
+        wordlo, wordhi = overlap_ranges(words, [s.start_time for s in segs], [s.end_time for s in segs])
+        phonelo, phonehi = overlap_ranges(phones, [w.start_time for w in words], [w.end_time for w in words])
+        # first and last phone of each word that is not a marker
+        labelled = np.flatnonzero([p.text not in PHONE_MARKERS for p in phones])
+        onsets = np.searchsorted(labelled, phonelo, side='left')
+        offsets = np.searchsorted(labelled, phonehi, side='left') - 1
+        for seg_iv, lo, hi in zip(segs, wordlo, wordhi):
+            for word_cnt, w in enumerate(range(lo, hi), 1):
+                aligniv = words[w]
+                record = [None] * len(ON_OFFSET_HEADER)
+                record[ids.TextGrid] = tg.filename
+                record[ids.Transcription] = aligniv.text
+                record[ids.NumWords] = int(hi - lo)
+                record[ids.Error] = 0
+                record[ids.ErrorMsg] = ""
+                record[ids.PresegBegin] = float(seg_iv.start_time)
+                record[ids.AlignOnset] = float(aligniv.start_time)
+                record[ids.AlignOffset] = float(aligniv.end_time)
+                if onsets[w] <= offsets[w]:
+                    record[ids.OnsetPhoneme] = phones[labelled[onsets[w]]].text
+                    record[ids.OffsetPhoneme] = phones[labelled[offsets[w]]].text
+                else:
+                    msg = "Phonetic alignment for %s seems empty after filtering: []" % aligniv
+                    logging.warning(msg)
+                    record[ids.OnsetPhoneme] = ""
+                    record[ids.OffsetPhoneme] = ""
+                    record[ids.Error] = 1
+                    record[ids.ErrorMsg] = msg
+                record[ids.WordCount] = word_cnt
+                records.append(record)
+    except Exception as e:
+        logging.error("On/Offset extraction failed for %s: %s" % (textgridfilename, e))
+        record = [None] * len(ON_OFFSET_HEADER)
+        record[ids.TextGrid] = textgridfilename
+        record[ids.Error] = 1
+        record[ids.ErrorMsg] = str(e)
+        records.append(record)
+    return records
+
+
+class XlsxExporter:
+    def __init__(self, sub_cmd_parser=None):
+        if sub_cmd_parser:
+            cmd_parser = sub_cmd_parser.add_parser('export-xlsx', help='write the sheets of an sqlite batch store to '
+                                                                       'an xlsx file for editing',
+                                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+            cmd_parser.set_defaults(cmd=self.run)
+            cmd_parser.add_argument('-s', dest='storefile', metavar='<store>', action='store', type=str,
+                                    required=True, help='sqlite batch store')
+            cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
+                                    required=True, help='xlsxfile to write')
 
-    def on_offsets_from_tg(self, textgridfilename, filtertiername, ws):
-        logging.info("Reading %s" % textgridfilename)
-        try:
-            tg = tgt.io.read_textgrid(textgridfilename)
-            align_tier = tg.get_tier_by_name("maus.ort")
-            pho_tier = tg.get_tier_by_name("maus.pho")
-            seg_tier = tg.get_tier_by_name(filtertiername)
-            for seg_iv in [s for s in seg_tier if s.text == "speech"]:
-                word_cnt = 1
-                align_ivs = align_tier.get_annotations_between_timepoints(seg_iv.start_time, seg_iv.end_time,
-                                                                          left_overlap=True, right_overlap=True)
-                for aligniv in align_ivs:
-                    self.rowpos += 1
-                    ws.cell(row=self.rowpos, column=self.colids.TextGrid).value = tg.filename
-                    ws.cell(row=self.rowpos, column=self.colids.Transcription).value = aligniv.text
-                    ws.cell(row=self.rowpos, column=self.colids.NumWords).value = len(align_ivs)
-                    ws.cell(row=self.rowpos, column=self.colids.Error).value = 0
-                    ws.cell(row=self.rowpos, column=self.colids.ErrorMsg).value = ""
-                    ws.cell(row=self.rowpos, column=self.colids.PresegBegin).value = float(seg_iv.start_time)
-                    ws.cell(row=self.rowpos, column=self.colids.AlignOnset).value = float(aligniv.start_time)
-                    ws.cell(row=self.rowpos, column=self.colids.AlignOffset).value = float(aligniv.end_time)
-                    pho_ivs = pho_tier.get_annotations_between_timepoints(aligniv.start_time, aligniv.end_time,
-                                                                          left_overlap=True, right_overlap=True)
-                    pho_ivs_cleaned = [x.text for x in pho_ivs if x.text not in ("?", "<p:>", "<usb>")]
-                    if pho_ivs_cleaned:
-                        ws.cell(row=self.rowpos, column=self.colids.OnsetPhoneme).value = pho_ivs_cleaned[0]
-                        ws.cell(row=self.rowpos, column=self.colids.OffsetPhoneme).value = pho_ivs_cleaned[-1]
-                    else:
-                        msg = "Phonetic alignment for %s seems empty after filtering: %s" % (aligniv, pho_ivs_cleaned)
-                        logging.warning(msg)
-                        ws.cell(row=self.rowpos, column=self.colids.OnsetPhoneme).value = ""
-                        ws.cell(row=self.rowpos, column=self.colids.OffsetPhoneme).value = ""
-                        ws.cell(row=self.rowpos, column=self.colids.Error).value = 1
-                        ws.cell(row=self.rowpos, column=self.colids.ErrorMsg).value = msg
-                    ws.cell(row=self.rowpos, column=self.colids.WordCount).value = word_cnt
-                    word_cnt += 1
-        except Exception as e:
-            logging.error("On/Offset extraction failed for %s: %s" % (textgridfilename, e))
-            self.rowpos += 1
-            ws.cell(row=self.rowpos, column=self.colids.TextGrid).value = textgridfilename
-            ws.cell(row=self.rowpos, column=self.colids.Error).value = 1
-            ws.cell(row=self.rowpos, column=self.colids.ErrorMsg).value = str(e)
+    def run(self, storefile, xlsxfile):
+        assert batchstore.is_sqlite(storefile), "%s is not an sqlite batch store" % storefile
+        copy_sheets(batchstore.open_store(storefile), batchstore.XlsxStore(xlsxfile))
+
+
+class XlsxImporter:
+    def __init__(self, sub_cmd_parser=None):
+        if sub_cmd_parser:
+            cmd_parser = sub_cmd_parser.add_parser('import-xlsx', help='replace the sheets of an sqlite batch store '
+                                                                       'by those of an xlsx file',
+                                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+            cmd_parser.set_defaults(cmd=self.run)
+            cmd_parser.add_argument('-x', dest='xlsxfile', metavar='<xlsfile>', action='store', type=str,
+                                    required=True, help='xlsxfile to read')
+            cmd_parser.add_argument('-s', dest='storefile', metavar='<store>', action='store', type=str,
+                                    required=True, help='sqlite batch store')
+
+    def run(self, xlsxfile, storefile):
+        assert batchstore.is_sqlite(storefile), "%s is not an sqlite batch store" % storefile
+        copy_sheets(batchstore.XlsxStore(xlsxfile, readonly=True), batchstore.open_store(storefile))
+
+
+def copy_sheets(source, target):
+    for sheet in batchstore.SHEETS:
+        if source.has_sheet(sheet):
+            header = source.header(sheet)
+            logging.info("Copying sheet %s from %s to %s" % (sheet, source.filename, target.filename))
+            target.write_sheet(sheet, header, (values for _, values in source.rows(sheet)))
+            if sheet == 'batch':
+                add_command_help(target, header)
+    target.save()
 
 
 def setup(sub_cmd_parser):
-    importers = [WavImporter, BatchRunner, TextGridBulkImporter, TextGridBulkExporter, OnOffsetExtractor]
+    importers = [WavImporter, BatchRunner, TextGridBulkImporter, TextGridBulkExporter, OnOffsetExtractor,
+                 XlsxExporter, XlsxImporter]
     for imp in importers:
         imp(sub_cmd_parser)
@@ -0,0 +1,190 @@
+import itertools
+import os
+import random
+import shutil
+import site
+import sys
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "src"))
+site.addsitedir(os.path.join(root, "lib", "python"))
+
+import tgt
+
+import aligntool
+
+
+def range_query_transcriptions(segtier, offsets, annotier, pdict):
+    """
+    generate_maus_transcriptions as it was before the sweep, with tgt's range queries.
+    """
+    result = []
+    for foffset in offsets:
+        seg_ivs = segtier.get_annotations_between_timepoints(foffset.start_time, foffset.end_time,
+                                                             left_overlap=True, right_overlap=True)
+        seg_ivs = [x for x in seg_ivs if x.text == "speech"]
+        assert len(seg_ivs) <= 1
+        if not seg_ivs:
+            result.append(None)
+            continue
+        wordsegments = annotier.get_annotations_between_timepoints(seg_ivs[0].start_time, seg_ivs[0].end_time,
+                                                                   left_overlap=True, right_overlap=True)
+        if len(wordsegments) == 0:
+            result.append(None)
+            continue
+        words = " ".join([x.text for x in wordsegments]).split()
+        result.append("".join(["ORT:\t%s\t%s\n" % (i, w) for i, w in enumerate(words)] +
+                              ["KAN:\t%s\t%s\n" % (i, pdict[w]) for i, w in enumerate(words)]))
+    return result
+
+
+def jittered(rs, times):
+    # boundaries of different tiers that fall within tgt's precision of 1e-4 of each other, or just outside of it
+    return sorted(t + rs.choice([0, 0, 3e-5, -3e-5, 9e-5, -9e-5, 1.5e-4, -1.5e-4]) for t in times)
+
+
+def interval_tier(name, bounds, texts):
+    tier = tgt.IntervalTier(name=name)
+    for (start, end), text in zip(zip(bounds, bounds[1:]), texts):
+        if text is not None:
+            tier.add_annotation(tgt.Interval(start, end, text))
+    return tier
+
+
+class GenerateMausTranscriptionsTest(unittest.TestCase):
+
+    def test_matches_range_queries(self):
+        rs = random.Random(3)
+        pdict = dict(("w%s" % i, "p%s" % i) for i in range(5))
+        compared = 0
+        for _ in range(300):
+            grid = [i * 0.1 for i in range(1, 40)]
+            segtier = interval_tier("seg", jittered(rs, grid),
+                                    [rs.choice(["speech", "", None]) for _ in grid])
+            annotier = interval_tier("anno", jittered(rs, grid),
+                                     [rs.choice([None, "w1", "w2 w3", "w4"]) for _ in grid])
+            bounds = jittered(rs, grid)
+            offsets = [tgt.Interval(start, end, "iv") for start, end in zip(bounds, bounds[1:])
+                       if rs.random() < 0.5]
+            try:
+                expected = range_query_transcriptions(segtier, offsets, annotier, pdict)
+            except AssertionError:
+                with self.assertRaises(AssertionError):
+                    aligntool.generate_maus_transcriptions(segtier, offsets, annotier, pdict)
+                continue
+            aligntool.generate_maus_transcriptions(segtier, offsets, annotier, pdict)
+            self.assertEqual(expected, [x.bpf if x.transcription_valid else None for x in offsets])
+            compared += 1
+        self.assertGreater(compared, 50)
+
+    def test_unsorted_offsets(self):
+        segtier = interval_tier("seg", [0, 1, 2], ["speech", "speech"])
+        offsets = [tgt.Interval(1, 2, "iv"), tgt.Interval(0, 1, "iv")]
+        with self.assertRaises(AssertionError):
+            aligntool.generate_maus_transcriptions(segtier, offsets, segtier, {})
+
+
+class ResolveBeepOverlapsTest(unittest.TestCase):
+
+    def test_best_match_per_beep(self):
+        beeplists = [[aligntool.BeepTuple(1.0, 1.2, 0.6), aligntool.BeepTuple(3.0, 3.2, 0.9)],
+                     [aligntool.BeepTuple(1.01, 1.21, 0.8), aligntool.BeepTuple(2.0, 2.2, 0.7),
+                      aligntool.BeepTuple(3.02, 3.22, 0.5)]]
+        selected = aligntool.resolve_beep_overlaps(beeplists, 0.55)
+        self.assertEqual([(float(anno.start_time), anno.correlation, rbindex) for anno, rbindex in selected],
+                         [(1.01, 0.8, 1), (2.0, 0.7, 1), (3.0, 0.9, 0)])
+
+    def test_below_mincorrelation(self):
+        beeplists = [[aligntool.BeepTuple(1.0, 1.2, 0.3)], [aligntool.BeepTuple(1.1, 1.3, 0.4)]]
+        self.assertEqual(aligntool.resolve_beep_overlaps(beeplists, 0.5), [])
+
+    def test_maximum_total_correlation(self):
+        rs = random.Random(5)
+        for _ in range(200):
+            beeplists = []
+            for _ in range(rs.randint(1, 3)):
+                starts = sorted(rs.uniform(0, 3) for _ in range(rs.randint(0, 4)))
+                beeplists.append([aligntool.BeepTuple(t, t + rs.choice([0.2, 0.5]), rs.random()) for t in starts])
+            selected = aligntool.resolve_beep_overlaps(beeplists, 0.2)
+            annos = [anno for anno, _ in selected]
+            for a, b in zip(annos, annos[1:]):
+                self.assertLessEqual(a.end_time, b.start_time)
+            # brute force over all non-overlapping subsets
+            valid = [bt for beeplist in beeplists for bt in beeplist if bt.correlation >= 0.2]
+            best = 0.0
+            for n in range(1, len(valid) + 1):
+                for subset in itertools.combinations(sorted(valid, key=lambda bt: bt.t_start), n):
+                    if all(a.t_end <= b.t_start for a, b in zip(subset, subset[1:])):
+                        best = max(best, sum(bt.correlation for bt in subset))
+            self.assertAlmostEqual(sum(anno.correlation for anno in annos), best)
+
+
+PAR = """LHD: Partitur 1.3
+ORT:\t0\thallo
+ORT:\t1\twelt
+KAN:\t0\thalo
+KAN:\t1\tvElt
+MAU:\t0\t1599\t-1\t<p:>
+MAU:\t1600\t799\t0\th
+MAU:\t2400\t1599\t0\ta
+MAU:\t4000\t799\t1\tv
+MAU:\t4800\t1599\t1\tElt
+MAU:\t6400\t3199\t-1\t<p:>
+"""
+
+
+class MausParTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def test_parse(self):
+        par = aligntool.parse_maus_par(self.write("iv1.par", PAR))
+        self.assertEqual(par.words, ["hallo", "welt"])
+        # pauses belong to no word, the last word ends with its last segment
+        self.assertEqual(par.word_begin.tolist(), [1600, 4000])
+        self.assertEqual(par.word_end.tolist(), [4000, 6400])
+        self.assertEqual(par.labels, ["<p:>", "h", "a", "v", "Elt", "<p:>"])
+        self.assertEqual(par.begin.tolist(), [0, 1600, 2400, 4000, 4800, 6400])
+        self.assertEqual(par.end.tolist(), [1600, 2400, 4000, 4800, 6400, 9600])
+
+    def test_no_alignment(self):
+        self.assertIsNone(aligntool.parse_maus_par(self.write("iv1.par", "ORT:\t0\thallo\nKAN:\t0\thalo\n")))
+
+    def test_incomplete(self):
+        with self.assertRaises(AssertionError):
+            aligntool.parse_maus_par(self.write("iv1.par", PAR.replace("\t1\tv\n", "\t-1\tv\n")
+                                                .replace("\t1\tElt", "\t-1\tElt")))
+        with self.assertRaises(AssertionError):
+            aligntool.parse_maus_par(self.write("iv2.par", PAR.replace("\t1\tElt", "\t2\tElt")))
+
+    def test_read_alignments(self):
+        self.write("iv1.par", PAR)
+        # iv2.par is missing, iv3.par holds no alignment
+        self.write("iv3.par", "ORT:\t0\thallo\n")
+        self.write("iv4.par", PAR)
+        offsets = [tgt.Interval(1.0, 1.6, "iv1"), tgt.Interval(2.0, 2.5, "iv2"), tgt.Interval(3.0, 3.5, "iv3"),
+                   tgt.Interval(10.0, 10.6, "iv4")]
+        for foffset in offsets:
+            foffset.transcription_valid = True
+        orttier, mautier = tgt.IntervalTier(name="maus.ort"), tgt.IntervalTier(name="maus.pho")
+        aligntool.read_maus_alignments(self.tmpdir, offsets, orttier, mautier, 16000)
+        self.assertEqual([(round(iv.start_time, 6), round(iv.end_time, 6), iv.text) for iv in orttier],
+                         [(1.1, 1.25, "hallo"), (1.25, 1.4, "welt"), (10.1, 10.25, "hallo"), (10.25, 10.4, "welt")])
+        self.assertEqual(len(mautier), 12)
+        self.assertEqual((float(mautier[0].start_time), float(mautier[5].end_time)), (1.0, 1.6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import concurrent.futures
+import os
+import shutil
+import site
+import sys
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "src"))
+site.addsitedir(os.path.join(root, "lib", "python"))
+
+import batchstore
+
+HEADER = ["TextGrid", "TierName", "StartTime"]
+
+
+def update_rows(storefile, rownums, value):
+    # each worker has its own connection, as the batch jobs do
+    store = batchstore.open_store(storefile)
+    store.ensure_columns('batch', ["Status"])
+    for rownum in rownums:
+        store.update_row('batch', rownum, {"Status": value, "Duration": rownum * 0.5})
+    store.close()
+
+
+def segrows(textgrid, n):
+    return [[textgrid, "tier", float(i)] for i in range(n)]
+
+
+class SqliteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.storefile = os.path.join(self.tmpdir, "s.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, sheet, rows):
+        store = batchstore.open_store(self.storefile)
+        store.write_sheet(sheet, HEADER, rows)
+        store.close()
+
+    def replace(self, replacements, order):
+        store = batchstore.open_store(self.storefile)
+        store.replace_textgrids('segments', HEADER, replacements, order)
+        store.close()
+
+    def read(self, sheet='segments'):
+        store = batchstore.open_store(self.storefile, readonly=True)
+        rows = list(store.rows(sheet))
+        store.close()
+        return rows
+
+    def test_concurrent_update_row(self):
+        self.write('batch', [["%s.TextGrid" % i, "tier", 0.0] for i in range(200)])
+        store = batchstore.open_store(self.storefile)
+        store.ensure_columns('batch', ["Duration"])
+        store.close()
+        for executor in (concurrent.futures.ThreadPoolExecutor(4), concurrent.futures.ProcessPoolExecutor(4)):
+            value = type(executor).__name__
+            with executor:
+                for f in [executor.submit(update_rows, self.storefile, range(2 + i, 202, 8), value)
+                          for i in range(8)]:
+                    f.result()
+            rows = self.read('batch')
+            self.assertEqual([x[0] for x in rows], list(range(2, 202)))
+            self.assertEqual([values[3:] for _, values in rows], [[rownum * 0.5, value] for rownum, _ in rows])
+        store = batchstore.open_store(self.storefile, readonly=True)
+        self.assertEqual(store.header('batch'), HEADER + ["Duration", "Status"])
+        store.close()
+
+    def test_replace_same_count_in_place(self):
+        self.write('segments', segrows("a", 2) + segrows("b", 2) + segrows("c", 1))
+        self.replace([("b", [["b", "new", 0.0], ["b", "new", 1.0]])], ["a", "b", "c"])
+        self.assertEqual(self.read(), [(2, ["a", "tier", 0.0]), (3, ["a", "tier", 1.0]), (4, ["b", "new", 0.0]),
+                                       (5, ["b", "new", 1.0]), (6, ["c", "tier", 0.0])])
+
+    def test_replace_keeps_batch_order(self):
+        self.write('segments', segrows("a", 2) + segrows("b", 2) + segrows("c", 1))
+        # b grows, c is removed, d is new and comes before a in the batch
+        self.replace([("b", segrows("b", 3)), ("c", []), ("d", segrows("d", 1))], ["d", "a", "b"])
+        self.assertEqual(self.read(), list(enumerate(segrows("d", 1) + segrows("a", 2) + segrows("b", 3), 2)))
+        # TextGrids missing from the order go last
+        self.replace([("a", segrows("a", 1))], ["b", "a"])
+        self.assertEqual(self.read(), list(enumerate(segrows("b", 3) + segrows("a", 1) + segrows("d", 1), 2)))
+
+    def test_replace_creates_table(self):
+        self.replace([("a", segrows("a", 2))], ["a"])
+        self.assertEqual(self.read(), list(enumerate(segrows("a", 2), 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import site
+import sys
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "src"))
+site.addsitedir(os.path.join(root, "lib", "python"))
+
+import numpy as np
+
+import dsp
+
+
+def reader(signal):
+    return lambda start, end: signal[start:end]
+
+
+class TimeOfMaximumTest(unittest.TestCase):
+
+    def setUp(self):
+        self.signal = np.random.RandomState(1).randn(4000)
+        self.dx = 1.0 / 1000
+
+    def test_block_edges(self):
+        # windows of unequal width at both ends of a block, the narrow ones are padded to the widest
+        offset, end = 1000, 2000
+        tmin = np.array([1.001, 1.002, 1.5, 1.996])
+        tmax = np.array([1.003, 1.4, 1.9, 1.998])
+        whole = dsp.time_of_maximum(self.signal, 0.0, self.dx, tmin, tmax)
+        block = dsp.time_of_maximum(self.signal[offset:end], 0.0, self.dx, tmin, tmax, offset=offset,
+                                    nsamples=len(self.signal))
+        np.testing.assert_array_equal(whole[0], block[0])
+        np.testing.assert_array_equal(whole[1], block[1])
+
+    def test_windows_clipped_at_signal_start(self):
+        tmin = np.array([-0.5, -0.01, 0.1])
+        tmax = np.array([0.002, 0.3, 0.2])
+        times, values = dsp.time_of_maximum(self.signal, 0.0, self.dx, tmin, tmax)
+        for t, v, lo, hi in zip(times, values, tmin, tmax):
+            i = int(round(t / self.dx))
+            self.assertTrue(0 <= i <= int(np.floor(hi / self.dx)))
+            self.assertEqual(v, self.signal[i])
+
+
+class BlockSizeTest(unittest.TestCase):
+    """
+    Streamed results have to match the whole signal at once for any block size.
+    """
+
+    def setUp(self):
+        rs = np.random.RandomState(2)
+        self.samplerate = 8000
+        self.signal = rs.randn(3 * self.samplerate) * 0.01
+        self.signal[12000:12400] += np.sin(np.arange(400) * 0.3)
+
+    def test_intensity(self):
+        whole = dsp.intensity(reader(self.signal), len(self.signal), self.samplerate, blocksize=len(self.signal) * 2)
+        for blocksize in (80, 1000, 4096):
+            times, values = dsp.intensity(reader(self.signal), len(self.signal), self.samplerate,
+                                          blocksize=blocksize)
+            np.testing.assert_array_equal(whole[0], times)
+            np.testing.assert_allclose(whole[1], values, rtol=0, atol=1e-9)
+
+    def test_spectral_subtraction(self):
+        def run(blocksize):
+            return np.concatenate(list(dsp.spectral_subtraction(reader(self.signal), len(self.signal),
+                                                                self.samplerate, 0.0, 1.0, blocksize=blocksize)))
+        whole = run(len(self.signal) * 2)
+        self.assertEqual(len(whole), len(self.signal))
+        for blocksize in (500, 4096):
+            np.testing.assert_allclose(whole, run(blocksize), rtol=0, atol=1e-9)
+
+    def test_cross_correlation(self):
+        template = np.sin(np.arange(100) * 0.3)
+        dx = 1.0 / self.samplerate
+        tmin = np.array([0.1, 1.45, 1.49, 2.9])
+        tmax = np.array([0.3, 1.6, 1.52, 3.1])
+        results = [dsp.cross_correlation_maxima(reader(self.signal), len(self.signal), template,
+                                                dsp.template_spectrum(template, nfft), nfft, dx, tmin, tmax)
+                   for nfft in (256, 1024, 65536)]
+        for times, values in results[:-1]:
+            np.testing.assert_allclose(results[-1][0], times, rtol=0, atol=1e-9)
+            np.testing.assert_allclose(results[-1][1], values, rtol=0, atol=1e-9)
+        # inside the sine burst at 1.5 - 1.55 s
+        self.assertTrue(1.5 <= results[-1][0][1] <= 1.55)
+
+    def test_seek_flanks(self):
+        dx = 1.0 / self.samplerate
+        times = np.array([0.01, 1.5, 1.51, 2.99])
+        whole = dsp.seek_flanks(self.signal, 0.5 * dx, dx, times)
+        for blocksize in (10, 1000):
+            np.testing.assert_array_equal(whole, dsp.seek_flanks_streaming(reader(self.signal), len(self.signal),
+                                                                           0.5 * dx, dx, times,
+                                                                           blocksize=blocksize))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import email.parser
+import email.policy
+import http.server
+import importlib
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+class G2PStandIn(http.server.BaseHTTPRequestHandler):
+    """
+    Local stand-in for the BAS g2p service. The result lines of a request are given by respond(words).
+    """
+    protocol_version = "HTTP/1.1"
+    respond = None
+    requests = []
+    results = {}
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, data):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+        words = next(x for x in message.iter_parts() if x.get_param("name", header="content-disposition") == "i") \
+            .get_content().split()
+        G2PStandIn.requests.append(words)
+        path = "/result%s" % len(G2PStandIn.requests)
+        G2PStandIn.results[path] = "".join("%s;%s\n" % line for line in G2PStandIn.respond(words))
+        self.reply(("<WebServiceResponseLink><success>true</success><downloadLink>http://127.0.0.1:%s%s"
+                    "</downloadLink></WebServiceResponseLink>" % (self.server.server_port, path)).encode())
+
+    def do_GET(self):
+        self.reply(G2PStandIn.results[self.path].encode("utf-8"))
+
+
+def spell(w):
+    return " ".join(w.upper())
+
+
+def setUpModule():
+    global g2p, server
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), G2PStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["ALIGNTOOL_G2P_URL"] = "http://127.0.0.1:%s/runG2P" % server.server_port
+    import g2p
+    # the url is read at import, g2p may have been imported by other tests already
+    g2p = importlib.reload(g2p)
+    g2p.retries = 1
+
+
+def tearDownModule():
+    server.shutdown()
+    server.server_close()
+
+
+class TranscribeTest(unittest.TestCase):
+
+    def setUp(self):
+        G2PStandIn.requests = []
+
+    def test_reordered_result(self):
+        G2PStandIn.respond = lambda words: [(w, spell(w)) for w in reversed(words)]
+        self.assertEqual(g2p.transcribe(["ab", "cd", "ef"], "deu-DE"), {"ab": "AB", "cd": "CD", "ef": "EF"})
+        self.assertEqual(len(G2PStandIn.requests), 1)
+
+    def test_rewritten_words_requested_singly(self):
+        numbers = {"2": "zwei", "3": "drei"}
+        G2PStandIn.respond = lambda words: [(numbers.get(w, w), spell(numbers.get(w, w))) for w in words]
+        self.assertEqual(g2p.transcribe(["3", "ab", "2"], "deu-DE"), {"2": "ZWEI", "3": "DREI", "ab": "AB"})
+        self.assertEqual(G2PStandIn.requests, [["2", "3", "ab"], ["2"], ["3"]])
+
+    def test_ambiguous_single_result(self):
+        G2PStandIn.respond = lambda words: [(w, spell(w)) for w in words if w != "2"] + \
+            ([("zwei", "ZWEI"), ("und", "UND")] if "2" in words else [])
+        with self.assertRaises(g2p.G2PException):
+            g2p.transcribe(["2", "ab"], "deu-DE")
+
+    def test_empty_transcription(self):
+        G2PStandIn.respond = lambda words: [(w, "" if w == "ab" else spell(w)) for w in words]
+        with self.assertRaises(g2p.G2PException):
+            g2p.transcribe(["ab", "cd"], "deu-DE")
+
+
+if __name__ == "__main__":
+    unittest.main()
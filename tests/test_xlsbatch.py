@@ -0,0 +1,250 @@
+import os
+import shutil
+import site
+import sys
+import tempfile
+import unittest
+import wave
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "src"))
+site.addsitedir(os.path.join(root, "lib", "python"))
+
+import tgt
+
+import batchstore
+import xlsbatch
+
+
+def write_wav(filename, seconds, samplerate=16000, channels=1):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with wave.open(filename, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes(b"\0\0" * channels * int(seconds * samplerate))
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wavdir = os.path.join(self.tmpdir, "wavs")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    def rows(self, storefile, sheet='batch'):
+        store = batchstore.open_store(storefile, readonly=True)
+        header = store.header(sheet)
+        rows = [dict(zip(header, values)) for _, values in store.rows(sheet)]
+        store.close()
+        return rows
+
+
+class WavImporterTest(BatchTestCase):
+
+    def test_scan(self):
+        write_wav(os.path.join(self.wavdir, "a", "x.wav"), 0.5)
+        write_wav(os.path.join(self.wavdir, "b", "x.wav"), 1.0, 8000, 2)
+        write_wav(os.path.join(self.wavdir, "b", "c", "y.WAV"), 0.25)
+        for storefile in (self.path("w.xlsx"), self.path("s.sqlite")):
+            xlsbatch.WavImporter().run(self.wavdir, storefile)
+            rows = self.rows(storefile)
+            self.assertEqual([os.path.relpath(x["Wavefile"], self.wavdir) for x in rows],
+                             ["a/x.wav", "b/c/y.WAV", "b/x.wav"])
+            prefix = os.path.splitext(storefile)[0]
+            # files with the same name get distinct TextGrids
+            self.assertEqual([x["TextGrid"] for x in rows],
+                             [prefix + ".tg/x.TextGrid", prefix + ".tg/y.TextGrid", prefix + ".tg/x1.TextGrid"])
+            self.assertEqual([(x["Duration"], x["Samplerate"], x["Channels"]) for x in rows],
+                             [(0.5, 16000, 1), (0.25, 16000, 1), (1.0, 8000, 2)])
+
+    def test_rescan(self):
+        storefile = self.path("s.sqlite")
+        write_wav(os.path.join(self.wavdir, "a", "x.wav"), 0.5)
+        write_wav(os.path.join(self.wavdir, "b", "y.wav"), 0.5)
+        xlsbatch.WavImporter().run(self.wavdir, storefile)
+        # user edits are kept, the scan index is reused for unchanged directories
+        store = batchstore.open_store(storefile)
+        header = store.header('batch') + ["Notes"]
+        rows = [values + ["note %s" % rownum] for rownum, values in store.rows('batch')]
+        rows[0][header.index("segmentSpeech")] = "-c 1"
+        store.write_sheet('batch', header, rows)
+        store.close()
+        os.remove(os.path.join(self.wavdir, "b", "y.wav"))
+        write_wav(os.path.join(self.wavdir, "b", "z.wav"), 0.5)
+        scanned = []
+        scan_directory = xlsbatch.scan_directory
+
+        def counting_scan(path, cached):
+            result = scan_directory(path, cached)
+            if result[1] is not cached:
+                scanned.append(os.path.relpath(path, self.wavdir))
+            return result
+        xlsbatch.scan_directory = counting_scan
+        try:
+            xlsbatch.WavImporter().run(self.wavdir, storefile)
+        finally:
+            xlsbatch.scan_directory = scan_directory
+        self.assertEqual(scanned, ["b"])
+        rows = self.rows(storefile)
+        self.assertEqual([(os.path.relpath(x["Wavefile"], self.wavdir), x["segmentSpeech"], x["Notes"])
+                          for x in rows], [("a/x.wav", "-c 1", "note 2"), ("b/z.wav", None, None)])
+
+
+class WhereTest(BatchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storefile = self.path("s.sqlite")
+        header = ["Wavefile", "TextGrid", "segmentSpeech", "Duration"]
+        rows = [["a.wav", "a.TextGrid", "-c 1", 10.0], ["b.wav", "b.TextGrid", None, 90.0],
+                ["c.wav", "c.TextGrid", "-c 2", 120.0], ["d.wav", "d.TextGrid", "-c 1", 30.0]]
+        store = batchstore.open_store(self.storefile)
+        store.write_sheet('batch', header, rows)
+        store.close()
+
+    def select(self, where):
+        store = batchstore.open_store(self.storefile, readonly=True)
+        return [(rownum, values[0]) for rownum, values in xlsbatch.select_rows(store, 'batch', where)]
+
+    def test_select_rows(self):
+        self.assertEqual(self.select(None), [(2, "a.wav"), (3, "b.wav"), (4, "c.wav"), (5, "d.wav")])
+        self.assertEqual(self.select("row['Duration'] > 60"), [(3, "b.wav"), (4, "c.wav")])
+        self.assertEqual(self.select("prevrow is not None and row['Duration'] > prevrow['Duration']"),
+                         [(3, "b.wav"), (4, "c.wav")])
+        self.assertEqual(self.select("row['segmentSpeech'] == '-c 1'"), [(2, "a.wav"), (5, "d.wav")])
+
+    def test_invalid_filter(self):
+        with self.assertRaises(AssertionError):
+            self.select("row['Duration']")
+        with self.assertRaises(SyntaxError):
+            self.select("row[")
+
+    def test_batch_rows(self):
+        store = batchstore.open_store(self.storefile, readonly=True)
+        rows = list(xlsbatch.BatchRunner().get_rows(store, ["segmentSpeech"], "row['Duration'] < 100"))
+        self.assertEqual(rows, [(2, "a.wav", "a.TextGrid", [["segmentSpeech", "-c", "1"]]),
+                                (3, "b.wav", "b.TextGrid", [["segmentSpeech"]]),
+                                (5, "d.wav", "d.TextGrid", [["segmentSpeech", "-c", "1"]])])
+
+
+class CostModelTest(BatchTestCase):
+
+    def test_bounded_log(self):
+        logfile = self.path("s.timings.jsonl")
+        wavfile = os.path.join(self.wavdir, "x.wav")
+        write_wav(wavfile, 30.0)
+        costmodel = xlsbatch.CostModel(logfile, history=10)
+        for i in range(100):
+            costmodel.record(wavfile, [("segmentSpeech", i), ("alignMAUS", 2 * i)])
+            with open(logfile) as f:
+                self.assertLessEqual(len(f.readlines()), 2 * 2 * 10 + 2)
+        # the rates come from the latest records only
+        costmodel = xlsbatch.CostModel(logfile, history=10)
+        self.assertAlmostEqual(costmodel.rates["segmentSpeech"], sum(range(90, 100)) / 5.0)
+        self.assertAlmostEqual(costmodel.rates["alignMAUS"], 2 * sum(range(90, 100)) / 5.0)
+        self.assertEqual(costmodel.rates["segmentBeeps"], xlsbatch.CostModel.DEFAULT_RATES["segmentBeeps"])
+        self.assertAlmostEqual(costmodel.estimate(wavfile, [["segmentSpeech"], ["alignMAUS"]]),
+                               0.5 * 3 * sum(range(90, 100)) / 5.0)
+
+
+def write_textgrid(filename, intervals):
+    tg = tgt.TextGrid()
+    tier = tgt.IntervalTier(name="words")
+    for start, end, text in intervals:
+        tier.add_annotation(tgt.Interval(start, end, text))
+    tg.add_tier(tier)
+    tgt.io.write_to_file(tg, filename)
+
+
+class TextGridImportExportTest(BatchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.textgrids = [self.path("%s.TextGrid" % x) for x in "abc"]
+        for i, filename in enumerate(self.textgrids):
+            write_textgrid(filename, [(0.0, 0.5, "w%s" % i), (0.5, 1.25, "v%s" % i)])
+        self.calls = []
+
+    def counting(self, name):
+        func = getattr(xlsbatch, name)
+
+        def counted(filename, *args):
+            self.calls.append(os.path.basename(filename))
+            return func(filename, *args)
+        return counted
+
+    def run_cmd(self, name, cmd, storefile):
+        func = getattr(xlsbatch, name)
+        setattr(xlsbatch, name, self.counting(name))
+        self.calls = []
+        try:
+            cmd.run(storefile)
+        finally:
+            setattr(xlsbatch, name, func)
+        return self.calls
+
+    def tgimport(self, storefile):
+        return self.run_cmd("import_textgrid", xlsbatch.TextGridBulkImporter(), storefile)
+
+    def tgexport(self, storefile):
+        return self.run_cmd("export_textgrid", xlsbatch.TextGridBulkExporter(), storefile)
+
+    def edit_segments(self, storefile, edit):
+        store = batchstore.open_store(storefile)
+        header = store.header('segments')
+        rows = [values for _, values in store.rows('segments')]
+        header, rows = edit(header, rows)
+        store.write_sheet('segments', header, rows)
+        store.save()
+        store.close()
+
+    def test_incremental(self):
+        results = []
+        for storefile in (self.path("w.xlsx"), self.path("s.sqlite")):
+            store = batchstore.open_store(storefile)
+            store.write_sheet('batch', ["Wavefile", "TextGrid"], [[x + ".wav", x] for x in self.textgrids])
+            store.save()
+            store.close()
+            for x in self.textgrids:
+                write_textgrid(x, [(0.0, 0.5, "w"), (0.5, 1.25, "v %s" % x)])
+            self.assertEqual(self.tgimport(storefile), ["a.TextGrid", "b.TextGrid", "c.TextGrid"])
+            self.assertEqual(self.tgimport(storefile), [])
+            self.assertEqual(self.tgexport(storefile), [])
+
+            # a column added by the user, the TextGrid a gets a segment more
+            self.edit_segments(storefile, lambda header, rows: (
+                header + ["Checked"], [row + ["ok %s" % i] for i, row in enumerate(rows)]))
+            write_textgrid(self.textgrids[0], [(0.0, 0.25, "u"), (0.25, 0.5, "w"), (0.5, 1.25, "new")])
+            self.assertEqual(self.tgimport(storefile), ["a.TextGrid"])
+            rows = [x for x in self.rows(storefile, 'segments')]
+            # the workbook reads empty texts back as None
+            self.assertEqual([(os.path.basename(x["TextGrid"]), x["TierName"], x["StartTime"], x["Text"] or "",
+                               x["Checked"]) for x in rows[:5]],
+                             [("a.TextGrid", "<range>", 0.0, "", "ok 0"), ("a.TextGrid", "words", 0.0, "u", "ok 1"),
+                              ("a.TextGrid", "words", 0.25, "w", None), ("a.TextGrid", "words", 0.5, "new", "ok 2"),
+                              ("b.TextGrid", "<range>", 0.0, "", "ok 3")])
+            self.assertEqual([x["Checked"] for x in rows[5:]], ["ok %s" % i for i in range(4, 9)])
+
+            # only the edited TextGrid is written, its file is read again by the next import
+            def edit_text(header, rows):
+                rows[6][header.index("Text")] = "edited"
+                return header, rows
+            self.edit_segments(storefile, edit_text)
+            self.assertEqual(self.tgexport(storefile), ["b.TextGrid"])
+            self.assertEqual([x.text for x in tgt.io.read_textgrid(self.textgrids[1]).get_tier_by_name("words")],
+                             ["w", "edited"])
+            self.assertEqual(self.tgimport(storefile), ["b.TextGrid"])
+            self.assertEqual(self.tgimport(storefile), [])
+            results.append([dict((k, xlsbatch.normalize_cell(v)) for k, v in dict(x, TextGrid=os.path.basename(
+                x["TextGrid"])).items()) for x in self.rows(storefile, 'segments')])
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == "__main__":
+    unittest.main()